@@ -0,0 +1,83 @@
+"""Scaling of the surface term to category sample join of ``main.py kg``.
+
+Generates synthetic subject and category sample outputs, with the ratios of
+terms, categories per term and samples growing together, and times the
+former nested-loop ``reconnect`` against :py:class:`CategoryJoin`, checking
+that both produce the same pages per surface term.
+
+    $ python benchmarks/category_join.py --sizes 250 500 1000 2000
+"""
+
+import argparse
+import random
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qexp.builder import CategoryJoin  # noqa: E402
+
+
+def make_outputs(terms: int, categories_per_term: int, sample_size: int):
+    rng = random.Random(1234)
+    # about as many distinct categories as terms, as in the subject outputs
+    categories = ["Category:Topic_{}".format(i) for i in range(terms)]
+    surface_to_categories = [
+        ("Term {}".format(i), rng.sample(categories, k=categories_per_term))
+        for i in range(terms)
+    ]
+    sampled = {c for _, cs in surface_to_categories for c in cs}
+    category_to_pagesample = [
+        (c, ["Page_{}".format(rng.randrange(terms * 10)) for _ in range(sample_size)])
+        for c in sorted(sampled)
+    ]
+    return surface_to_categories, category_to_pagesample
+
+
+def reconnect(surface_to_categories, category_to_pagesample):
+    to_return = defaultdict(set)
+    for surface_term, categories in surface_to_categories:
+        for category_i in categories:
+            for category_j, pagesample in category_to_pagesample:
+                if category_j == category_i:
+                    to_return[surface_term].update(pagesample)
+
+    return [(subject, list(pages)) for subject, pages in to_return.items()]
+
+
+def category_join(surface_to_categories, category_to_pagesample):
+    return list(CategoryJoin(category_to_pagesample).run(surface_to_categories))
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[250, 500, 1000, 2000], help="terms"
+    )
+    parser.add_argument("--categories", type=int, default=8, help="per term")
+    parser.add_argument("--sample", type=int, default=5, help="pages per category")
+    args = parser.parse_args()
+
+    print(
+        "{:>8} {:>10} {:>12} {:>10} {:>9}".format(
+            "terms", "samples", "reconnect", "join", "speedup"
+        )
+    )
+    for size in args.sizes:
+        outputs = make_outputs(size, args.categories, args.sample)
+        nested, expected = timed(reconnect, *outputs)
+        hashed, actual = timed(category_join, *outputs)
+        assert {k: set(v) for k, v in expected} == {k: set(v) for k, v in actual}
+        print(
+            "{:>8} {:>10} {:>11.3f}s {:>9.4f}s {:>8.0f}x".format(
+                size, len(outputs[1]), nested, hashed, nested / hashed
+            )
+        )
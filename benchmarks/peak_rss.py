@@ -0,0 +1,136 @@
+"""Peak-RSS comparison of the copying and the buffer/streaming read paths.
+
+Generates a synthetic file-backed cache, uncompressed and compressed with
+each ``--compression`` codec, and runs each variant in a fresh interpreter,
+reporting its ``ru_maxrss``:
+
+* ``categories``: category-link scan as in ``main.py categories --rebuild``
+* ``index``: lunr index build as in ``experiment_2``
+
+The copying variants read every value as a ``str`` through
+:py:meth:`DataCache.get`, the others use the buffer and streaming paths.
+
+    $ python benchmarks/peak_rss.py --articles 400 --size 80000 --compression gzip
+"""
+
+import argparse
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qexp import DataCache  # noqa: E402
+
+WORDS = "the of and in to a was is for on as by with he that at from his it".split()
+
+
+def make_corpus(cache_dir: str, articles: int, size: int, compression: str | None):
+    rng = random.Random(1234)
+    cache = DataCache(cache_dir, compression=compression)
+    for article in range(articles):
+        words = []
+        while sum(map(len, words)) < size:
+            words.extend(rng.choices(WORDS, k=50))
+            words.append("[[Category:Topic {}]]".format(rng.randrange(500)))
+        cache.set(str(article), " ".join(words))
+
+
+def categories_copy(cache_dir: str):
+    cache = DataCache(cache_dir)
+    found = 0
+    for key in cache.keys():
+        contents = cache.get(key)
+        found += len(re.findall(r"\[\[(Category:.*?)[\]|\|]", contents))
+    return found
+
+
+def categories_buffer(cache_dir: str):
+    cache = DataCache(cache_dir)
+    found = 0
+    for _, contents in cache.iter_buffers(cache.keys()):
+        found += len(re.findall(rb"\[\[(Category:.*?)[\]|\|]", contents))
+    return found
+
+
+def index_copy(cache_dir: str):
+    import lunr
+
+    cache = DataCache(cache_dir)
+    documents = [{"id": key, "body": cache.get(key)} for key in cache.keys()]
+    return lunr.lunr(ref="id", fields=("body",), documents=documents)
+
+
+def index_streaming(cache_dir: str):
+    from qexp.search import Search
+
+    cache = DataCache(cache_dir)
+    return Search(collection=cache.iter_items(cache.keys(), chunk_size=50))
+
+
+VARIANTS = {
+    "categories_copy": categories_copy,
+    "categories_buffer": categories_buffer,
+    "index_copy": index_copy,
+    "index_streaming": index_streaming,
+}
+
+
+def peak_rss_mb(variant: str, cache_dir: str) -> float:
+    out = subprocess.run(
+        [sys.executable, __file__, "--run", variant, cache_dir],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return float(out.stdout.strip())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--articles", type=int, default=400)
+    parser.add_argument("--size", type=int, default=80000, help="bytes per article")
+    parser.add_argument(
+        "--compression",
+        nargs="*",
+        default=["gzip"],
+        choices=["gzip", "zstd"],
+        help="codecs to measure besides the uncompressed cache",
+    )
+    parser.add_argument("--run", nargs=2, metavar=("VARIANT", "CACHE_DIR"))
+    args = parser.parse_args()
+
+    if args.run:
+        variant, cache_dir = args.run
+        VARIANTS[variant](cache_dir)
+        # ru_maxrss is in KiB on Linux
+        print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        sys.exit(0)
+
+    print(
+        "{} articles, {:.1f} MB".format(args.articles, args.articles * args.size / 1e6)
+    )
+    for compression in [None, *args.compression]:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir = str(Path(tmp) / "cache")
+            make_corpus(cache_dir, args.articles, args.size, compression)
+            for before, after in (
+                ("categories_copy", "categories_buffer"),
+                ("index_copy", "index_streaming"),
+            ):
+                rss_before = peak_rss_mb(before, cache_dir)
+                rss_after = peak_rss_mb(after, cache_dir)
+                print(
+                    "{:<6} {:<18} {:8.1f} MB -> {:<18} {:8.1f} MB ({:+.1%})".format(
+                        compression or "plain",
+                        before,
+                        rss_before,
+                        after,
+                        rss_after,
+                        rss_after / rss_before - 1,
+                    )
+                )
@@ -0,0 +1,130 @@
+"""Throughput and agreement of the WikitextExtractor stripping engines.
+
+Strips a sample corpus with every engine, reporting revisions and MB per
+second, and compares the word tokens of each engine's output to those of
+``mwparser``, the reference: precision, recall and F1 over the token
+multisets of all revisions, plus the share of revisions with identical
+tokens.
+
+The corpus is a sample of the cached raw revisions (``[data] extracts_path``
+of ``--config``) if there are any, a synthetic wikitext corpus otherwise.
+
+    $ python benchmarks/strip_engines.py --sample 200
+"""
+
+import argparse
+import collections
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qexp import Config, DataCache  # noqa: E402
+from qexp.extractors.WikitextExtractor import ENGINES, WikitextExtractor  # noqa: E402
+
+WORDS = "the of and in to a was is for on as by with he that at from his it".split()
+TOKEN = re.compile(r"\w+")
+
+
+def synthetic_revision(rng: random.Random, paragraphs: int) -> str:
+    def words(k: int) -> str:
+        return " ".join(rng.choices(WORDS, k=k))
+
+    parts = ["{{Infobox thing\n| name = %s\n| size = {{convert|3|km}}\n}}\n" % words(3)]
+    for i in range(paragraphs):
+        parts.append("== Section %d ==\n" % i)
+        parts.append(
+            "'''%s''' %s [[Target %d|%s]] %s [[Plain link]]s.<ref name=r%d>{{cite web"
+            "|url=http://example.org|title=%s}}</ref> %s [http://example.org %s]"
+            " &amp; %s.<!-- note -->\n"
+            % (
+                words(2),
+                words(12),
+                i,
+                words(2),
+                words(10),
+                i,
+                words(4),
+                words(8),
+                words(2),
+                words(6),
+            )
+        )
+        parts.append("* %s\n* %s\n" % (words(5), words(5)))
+        if i % 3 == 0:
+            parts.append("{| class=wikitable\n| %s || %s\n|}\n" % (words(2), words(2)))
+        if i % 4 == 0:
+            parts.append(
+                "[[File:Picture %d.jpg|thumb|%s [[Caption link]]]]\n" % (i, words(4))
+            )
+    parts.append("[[Category:Things]]\n[[Category:Other things]]\n")
+    return "".join(parts)
+
+
+def load_corpus(config_path: str, sample: int, paragraphs: int):
+    if Path(config_path).exists():
+        cache = DataCache.from_config(Config(Path(config_path)), "extracts_path")
+        keys = list(cache.keys())
+        if keys:
+            keys = random.Random(1234).sample(keys, k=min(sample, len(keys)))
+            return "cached revisions", [text for _, text in cache.iter_items(keys)]
+
+    rng = random.Random(1234)
+    return "synthetic revisions", [
+        synthetic_revision(rng, paragraphs) for _ in range(sample)
+    ]
+
+
+def agreement(reference, candidate):
+    overlap = predicted = expected = identical = 0
+    for ref, cand in zip(reference, candidate):
+        ref_tokens = collections.Counter(TOKEN.findall(ref))
+        cand_tokens = collections.Counter(TOKEN.findall(cand))
+        overlap += sum((ref_tokens & cand_tokens).values())
+        predicted += sum(cand_tokens.values())
+        expected += sum(ref_tokens.values())
+        identical += ref_tokens == cand_tokens
+    precision = overlap / predicted if predicted else 1.0
+    recall = overlap / expected if expected else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if overlap else 0.0
+    return precision, recall, f1, identical / len(reference)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default="config.toml")
+    parser.add_argument("--sample", type=int, default=200, help="revisions")
+    parser.add_argument(
+        "--paragraphs", type=int, default=30, help="per synthetic revision"
+    )
+    args = parser.parse_args()
+
+    source, corpus = load_corpus(args.config, args.sample, args.paragraphs)
+    megabytes = sum(map(len, corpus)) / 2**20
+    print("{} {}, {:.1f} MB".format(len(corpus), source, megabytes))
+
+    outputs = {}
+    for engine in ENGINES:
+        extractor = WikitextExtractor(cache=None, engine=engine)
+        start = time.perf_counter()
+        outputs[engine] = [clean for clean, _ in extractor._strip_chunk(corpus)]
+        elapsed = time.perf_counter() - start
+        print(
+            "{:<10} {:8.2f}s {:10.1f} revisions/s {:8.2f} MB/s".format(
+                engine, elapsed, len(corpus) / elapsed, megabytes / elapsed
+            )
+        )
+
+    for engine in ENGINES[1:]:
+        precision, recall, f1, identical = agreement(
+            outputs[ENGINES[0]], outputs[engine]
+        )
+        print(
+            "{} vs {}: token precision {:.3f}, recall {:.3f}, F1 {:.3f},"
+            " identical {:.1%}".format(
+                engine, ENGINES[0], precision, recall, f1, identical
+            )
+        )
@@ -1,9 +1,10 @@
 import argparse
 import logging
+import os
 import sys
 from pathlib import Path
 
-from qexp import Config, experiments, steps
+from qexp import Config, DataCache, experiments, steps
 
 if __name__ == "__main__":
     levels = (
@@ -23,6 +24,11 @@ if __name__ == "__main__":
     parser_categories = subparsers.add_parser(
         "categories", help="Collect category labels from the cached articles"
     )
+    parser_categories.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Index the categories of revisions cleaned before the index existed",
+    )
     parser_categories.set_defaults(func=steps.build_categories)
 
     parser_embeddings = subparsers.add_parser(
@@ -71,6 +77,40 @@ if __name__ == "__main__":
     parser_exp_2.add_argument("--results-path", type=str)
     parser_exp_2.set_defaults(func=experiments.experiment2)
 
+    parser_compress = subparsers.add_parser(
+        "compress",
+        help="Recompress cached entries as configured in [cache.compression]",
+    )
+    parser_compress.add_argument(
+        "--workers", "-w", type=int, default=os.cpu_count(), help="Worker processes"
+    )
+    parser_compress.add_argument(
+        "--chunk-size", type=int, default=1000, help="Entries per worker task"
+    )
+    parser_compress.add_argument(
+        "options",
+        nargs="*",
+        help="[data] options naming the caches to rewrite, defaults to all"
+        " caches listed in [cache.compression]",
+    )
+    parser_compress.set_defaults(func=steps.compress_cache)
+
+    parser_dbpedia = subparsers.add_parser(
+        "dbpedia",
+        help="Ingest DBpedia N-Triples dumps into [dbpedia] store_path",
+    )
+    parser_dbpedia.add_argument(
+        "--labels", help="rdfs:label triples, e.g. labels_lang=en.ttl.bz2"
+    )
+    parser_dbpedia.add_argument(
+        "--subjects",
+        help="dct:subject triples, e.g. categories_lang=en_articles.ttl.bz2",
+    )
+    parser_dbpedia.add_argument(
+        "--page-ids", help="wikiPageID triples, e.g. page_lang=en_ids.ttl.bz2"
+    )
+    parser_dbpedia.set_defaults(func=steps.ingest_dbpedia)
+
     # Parse args for the first time to get verbosity and config
     args = parser.parse_args(sys.argv[1:])
 
@@ -90,8 +130,14 @@ if __name__ == "__main__":
     parser_search_config.set_defaults(config=config)
     parser_exp_1.set_defaults(config=config)
     parser_exp_2.set_defaults(config=config)
+    parser_compress.set_defaults(config=config)
+    parser_dbpedia.set_defaults(config=config)
 
     # Parse args again to configure dispatch
     args = parser.parse_args(sys.argv[1:])
 
-    args.func(args)
+    ret = args.func(args)
+
+    DataCache.log_metrics()
+
+    sys.exit(ret)
@@ -1,21 +1,401 @@
+import base64
+import datetime
+import hashlib
+import itertools as it
+import json
+import logging
+import os
+import pickle
+import resource
+import time
+import typing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from qexp import DataCache, types
+from qexp.cache import CacheMetrics
+from qexp.util.parallel import chunked
+
+
+def _cache_counts(step) -> typing.Tuple[int, int]:
+    metrics = getattr(getattr(step, "cache", None), "metrics", None)
+    if metrics is None:
+        return 0, 0
+    return metrics.hits, metrics.misses
+
+
+def _run_step(step, xs) -> list:
+    return list(step.run(xs))
+
+
+def _run_step_in_worker(step, xs) -> typing.Tuple[list, CacheMetrics | None]:
+    """Run ``step``, a copy unpickled in a worker process, with its cache
+    counting into fresh metrics, which are returned for the parent to merge."""
+    metrics = getattr(getattr(step, "cache", None), "metrics", None)
+    if metrics is not None:
+        step.cache.metrics = metrics = CacheMetrics(metrics.cache_dir)
+    return list(step.run(xs)), metrics
+
+
+def _digest(obj) -> str:
+    return hashlib.sha1(pickle.dumps(obj, protocol=4)).hexdigest()
+
+
+def _item_key(x):
+    # keyed steps emit (key, ...) tuples where key is the input item itself
+    # or its first element
+    return x if isinstance(x, str) else x[0]
+
+
+def _assign(batch: list, results: list) -> typing.Dict[str, list]:
+    """Map the outputs of a keyed step to the ``(digest, item)`` inputs they
+    belong to. Inputs sharing a key get one output each if there are as many
+    outputs as inputs, otherwise the first of them gets all, so no output is
+    returned twice."""
+    by_key = {}
+    for result in results:
+        by_key.setdefault(result[0], []).append(result)
+    sharing = {}
+    for digest, x in batch:
+        sharing.setdefault(_item_key(x), []).append(digest)
+
+    assigned = {}
+    for key, digests in sharing.items():
+        key_results = by_key.get(key, [])
+        if len(digests) > 1 and len(key_results) == len(digests):
+            assigned.update((digest, [r]) for digest, r in zip(digests, key_results))
+        else:
+            assigned.update((digest, []) for digest in digests[1:])
+            assigned[digests[0]] = key_results
+    return assigned
+
+
+def _config_hash(step) -> str:
+    """Hash of a step's type and configuration.
+
+    Steps can describe their configuration with ``checkpoint_config()``;
+    otherwise their plain str/int/float/bool attributes are used.
+    """
+    if hasattr(step, "checkpoint_config"):
+        config = step.checkpoint_config()
+    else:
+        config = {
+            k: v
+            for k, v in vars(step).items()
+            if isinstance(v, (str, int, float, bool, type(None)))
+        }
+    return _digest((type(step).__qualname__, sorted(config.items())))[:12]
+
+
+class StepStats(object):
+    """Accumulated cost of one pipeline step over all of its calls.
+
+    ``maxrss_delta`` is how far the step pushed the process' peak resident
+    set size, which is only meaningful for the main process.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.items_in = 0
+        self.items_out = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.checkpoint_hits = 0
+        self.maxrss_delta = 0
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items_in / self.seconds if self.seconds else 0.0
+
+    @property
+    def cache_hit_ratio(self) -> float | None:
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else None
+
+    def summary(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "name": self.name,
+            "seconds": self.seconds,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "items_per_second": self.items_per_second,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_ratio": self.cache_hit_ratio,
+            "checkpoint_hits": self.checkpoint_hits,
+            "maxrss_delta_mb": self.maxrss_delta / 1024,
+        }
+
+
 class Pipeline(object):
-    def __init__(self, steps):
+    """Chain of steps, each exposing ``run(xs)``.
+
+    By default every step consumes the complete output of its predecessor.
+    With ``stream=True`` the steps are instead fed windows of at most
+    ``window`` items and ``run`` returns a lazy iterator, so only a window
+    per step is alive at any time.
+
+    Intermediate outputs are only kept for the step indices in ``retain``;
+    after ``run`` (or, when streaming, once its iterator is exhausted)
+    ``pipeline.steps[idx][1]`` holds the list of outputs of step ``idx``.
+
+    Steps declaring ``parallelism = types.CPU_BOUND`` or ``types.IO_BOUND``
+    have their input split into chunks which are run on a process or thread
+    pool of ``workers``; the outputs are concatenated in input order, so the
+    result does not depend on the number of workers. Steps running pools of
+    their own keep them open across windows; the pipeline calls their
+    ``close`` method once the run ends.
+
+    Each run records a :py:class:`StepStats` per step, logs them as a table
+    once the run completes and appends them as one JSON line to
+    ``report_path``, if given.
+
+    With a ``checkpoint_dir``, steps declaring ``checkpoint = True`` persist
+    their output per input item, ``CHECKPOINT_EVERY`` items at a time, under
+    the step's name and a hash of its configuration. A rerun after a crash
+    only recomputes items that have not been stored yet or whose input
+    changed. Such steps must be keyed: each output is a tuple whose first
+    element is the input item (or the input's first element) it belongs to.
+    A stored output is never recomputed, so steps that swallow lookup errors
+    and return partial outputs must not be checkpointed.
+    """
+
+    WINDOW = 500
+    CHECKPOINT_EVERY = 50
+
+    def __init__(
+        self,
+        steps,
+        stream: bool = False,
+        window: int = WINDOW,
+        retain: typing.Iterable[int] = (),
+        workers: int = 1,
+        report_path: str | None = None,
+        checkpoint_dir: str | None = None,
+    ):
         self._steps = steps
+        self.stream = stream
+        self.window = window
+        self.retain = set(retain)
+        self.workers = workers
+        self.report_path = report_path
+        self.checkpoint_dir = checkpoint_dir
+        self._checkpoints: typing.Dict[int, DataCache] = {}
+        self.stats: typing.List[StepStats] = []
+        self.logger = logging.getLogger("main")
+        self._executors: typing.Dict[str, Executor] = {}
 
     @property
     def steps(self):
         return self._steps
 
     def run(self, xs):
-        for idx, (name, step) in enumerate(self._steps):
-            xs = step.run(xs)
-            self.steps[idx] = (name, xs)
+        self.stats = [StepStats(name) for name, _ in self._steps]
+        self._open_checkpoints()
+        if self.stream:
+            return self._run_streaming(xs)
+
+        # retained steps are replaced by their outputs along the way
+        steps = [step for _, step in self._steps]
+        try:
+            for idx, (name, step) in enumerate(self._steps):
+                xs = self._apply(idx, step, xs)
+                if idx in self.retain:
+                    self.steps[idx] = (name, xs)
+        finally:
+            self._shutdown(steps)
 
+        self.report()
         return xs
 
+    def _run_streaming(self, xs) -> typing.Iterator:
+        steps = [step for _, step in self._steps]
+        for idx, (name, step) in enumerate(self._steps):
+            retained = None
+            if idx in self.retain:
+                retained = []
+                self.steps[idx] = (name, retained)
+            xs = self._stage(idx, step, xs, retained)
+
+        try:
+            yield from xs
+        finally:
+            self._shutdown(steps)
+
+        self.report()
+
+    def _stage(self, idx: int, step, xs, retained: list | None) -> typing.Iterator:
+        xs = iter(xs)
+        while window := list(it.islice(xs, self.window)):
+            for x in self._apply(idx, step, window):
+                if retained is not None:
+                    retained.append(x)
+                yield x
+
+    def _open_checkpoints(self):
+        self._checkpoints = {}
+        if self.checkpoint_dir is None:
+            return
+
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        for idx, (name, step) in enumerate(self._steps):
+            if getattr(step, "checkpoint", False):
+                self._checkpoints[idx] = DataCache(
+                    os.path.join(
+                        self.checkpoint_dir, "{}-{}".format(name, _config_hash(step))
+                    ),
+                    backend="sqlite",
+                )
+
+    def _apply(self, idx: int, step, xs) -> list:
+        stats = self.stats[idx]
+        xs = list(xs)
+        hits, misses = _cache_counts(step)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+
+        if idx in self._checkpoints:
+            results = self._run_checkpointed(step, xs, self._checkpoints[idx], stats)
+        else:
+            results = self._run(step, xs)
+
+        stats.seconds += time.perf_counter() - start
+        stats.maxrss_delta += (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxrss
+        )
+        hits_after, misses_after = _cache_counts(step)
+        stats.cache_hits += hits_after - hits
+        stats.cache_misses += misses_after - misses
+        stats.items_in += len(xs)
+        stats.items_out += len(results)
+        return results
+
+    def _run(self, step, xs: list) -> list:
+        kind = getattr(step, "parallelism", None)
+        if kind is None or self.workers <= 1 or len(xs) < 2:
+            return list(step.run(xs))
+        return self._fan_out(step, xs, kind)
+
+    def _run_checkpointed(
+        self, step, xs: list, store: DataCache, stats: StepStats
+    ) -> list:
+        digests = [_digest(x) for x in xs]
+        stored = store.get_many(digests)
+        stats.checkpoint_hits += sum(digest in stored for digest in set(digests))
+
+        outputs = {
+            digest: pickle.loads(base64.b64decode(value))
+            for digest, value in stored.items()
+        }
+        todo = list({d: x for d, x in zip(digests, xs) if d not in outputs}.items())
+        for start in range(0, len(todo), self.CHECKPOINT_EVERY):
+            batch = todo[start : start + self.CHECKPOINT_EVERY]
+            fresh = _assign(batch, self._run(step, [x for _, x in batch]))
+            store.set_many(
+                (digest, base64.b64encode(pickle.dumps(results)).decode("ascii"))
+                for digest, results in fresh.items()
+            )
+            outputs.update(fresh)
+
+        return [result for digest in digests for result in outputs[digest]]
+
+    def _fan_out(self, step, xs: list, kind: str) -> list:
+        chunks = chunked(xs, self.workers)
+        executor = self._executor(kind)
+        if kind != types.CPU_BOUND:
+            return [
+                x
+                for chunk in executor.map(_run_step, it.repeat(step), chunks)
+                for x in chunk
+            ]
+
+        results = []
+        for chunk, metrics in executor.map(
+            _run_step_in_worker, it.repeat(step), chunks
+        ):
+            results.extend(chunk)
+            if metrics is not None:
+                # worker processes counted on their own copy of the cache
+                step.cache.metrics.merge(metrics)
+        return results
+
+    def _executor(self, kind: str) -> Executor:
+        if kind not in self._executors:
+            match kind:
+                case types.CPU_BOUND:
+                    executor = ProcessPoolExecutor(self.workers)
+                case types.IO_BOUND:
+                    executor = ThreadPoolExecutor(self.workers)
+                case _:
+                    raise ValueError("Unknown step parallelism {!r}".format(kind))
+            self._executors[kind] = executor
+        return self._executors[kind]
+
+    def _shutdown(self, steps: list):
+        for executor in self._executors.values():
+            executor.shutdown()
+        self._executors.clear()
+        # steps running their own pools keep them open across calls
+        for step in steps:
+            if hasattr(step, "close"):
+                step.close()
+
+    def report(self):
+        self.logger.info(
+            "{:<28} {:>9} {:>9} {:>10} {:>9} {:>6} {:>9} {:>10}".format(
+                "step",
+                "in",
+                "out",
+                "seconds",
+                "items/s",
+                "hit%",
+                "resumed",
+                "maxrss+MB",
+            )
+        )
+        for stats in self.stats:
+            hit_ratio = stats.cache_hit_ratio
+            self.logger.info(
+                "{:<28} {:>9} {:>9} {:>10.2f} {:>9.1f} {:>6} {:>9} {:>10.1f}".format(
+                    stats.name,
+                    stats.items_in,
+                    stats.items_out,
+                    stats.seconds,
+                    stats.items_per_second,
+                    "-" if hit_ratio is None else "{:.1%}".format(hit_ratio),
+                    stats.checkpoint_hits,
+                    stats.maxrss_delta / 1024,
+                )
+            )
+
+        if self.report_path is not None:
+            with open(self.report_path, "a") as f:
+                record = {
+                    "finished": datetime.datetime.now().isoformat(),
+                    "workers": self.workers,
+                    "stream": self.stream,
+                    "steps": [stats.summary() for stats in self.stats],
+                }
+                f.write(json.dumps(record) + "\n")
+
+    @staticmethod
+    def drain(xs: typing.Iterable):
+        """Exhaust ``xs`` for its side effects, e.g. filling the caches."""
+        for _ in xs:
+            pass
+
+    @classmethod
+    def make_pipeline(cls, *steps, **kwargs):
+        return Pipeline(cls._name_steps(steps), **kwargs)
+
     @classmethod
-    def make_pipeline(cls, *steps):
-        return Pipeline(cls._name_steps(steps))
+    def from_config(cls, config, *steps, **kwargs):
+        """Like :py:meth:`make_pipeline`, taking ``workers``, ``report_path``
+        and ``checkpoint_dir`` from the ``[pipeline]`` section."""
+        kwargs.setdefault("workers", config.get("pipeline", "workers") or 1)
+        kwargs.setdefault("report_path", config.get("pipeline", "report_path"))
+        kwargs.setdefault("checkpoint_dir", config.get("pipeline", "checkpoint_path"))
+        return cls.make_pipeline(*steps, **kwargs)
 
     @staticmethod
     def _name_steps(steps):
@@ -1,26 +1,53 @@
 import itertools as it
+import logging
 import os
 import pprint
+import random
 import sys
 import typing
-from collections import defaultdict
 from multiprocessing import Pool
 from typing import List
 
-import igraph
-
 import qexp.util.types as mytypes
 from qexp import Config, DataCache
 from qexp.extractors import (
-    SpotlightExtractor,
-    SubjectExtractor,
     WikipediaCategorySampler,
-    WikipediaRevisionExtractor,
-    WikitextExtractor,
+    revision_extractor,
+    subject_extractor,
+    surface_term_extractor,
+    wikitext_extractor,
 )
+from qexp.graph import CSRGraph
 from qexp.Pipeline import Pipeline
+from qexp.util.parallel import chunk_size
+
+
+class CategoryJoin(object):
+    """Hash join of surface terms to the pages sampled from their categories.
+
+    The ``(category, pages)`` samples are indexed by category once, after
+    which :py:meth:`run` costs one lookup per category of a surface term,
+    instead of a scan over all samples.
+    """
+
+    def __init__(self, category_samples: typing.Iterable[mytypes.PipelineResult]):
+        # dicts rather than sets keep the pages in the order they were sampled
+        self.index: typing.Dict[str, typing.Dict[str, None]] = {}
+        for category, pages in category_samples:
+            self.index.setdefault(category, {}).update(dict.fromkeys(pages))
 
-KnowledgeGraph = igraph.Graph
+    def run(
+        self, surface_to_categories: typing.Iterable[mytypes.PipelineResult]
+    ) -> typing.Iterator[mytypes.PipelineResult]:
+        """``(surface term, pages)`` for every surface term with at least one
+        sampled category, lazily and in input order. A surface term occurring
+        more than once is joined each time."""
+        for surface_term, categories in surface_to_categories:
+            pages = {}
+            for category in categories:
+                pages.update(self.index.get(category, {}))
+            if pages:
+                yield surface_term, list(pages)
 
 
 class KnowledgeGraphBuilder(object):
@@ -29,92 +56,163 @@ class KnowledgeGraphBuilder(object):
         self.config = config
 
     @classmethod
-    def to_edgelist(cls, xs: List[mytypes.PipelineResult]) -> List[mytypes.Edge]:
-        return list(
-            it.chain.from_iterable((zip(it.repeat(key), values) for key, values in xs))
+    def iter_edges(
+        cls, xs: typing.Iterable[mytypes.PipelineResult]
+    ) -> typing.Iterator[mytypes.Edge]:
+        return it.chain.from_iterable(
+            (zip(it.repeat(key), values) for key, values in xs)
         )
 
-    def __call__(self, articles, **kwargs) -> KnowledgeGraph:
-        pipeline = Pipeline.make_pipeline(
-            WikipediaRevisionExtractor(
-                url=self.config.get("wikipedia", "endpoint"),
-                cache=DataCache(self.config.get("data", "extracts_path")),
-            ),
-            WikitextExtractor(
-                cache=DataCache(self.config.get("data", "clean_path")),
-            ),
-            SpotlightExtractor(
-                url=self.config.get("dbpedia", "url"),
-                cache=DataCache(self.config.get("data", "surface_term_path")),
-            ),
-            SubjectExtractor(
-                endpoint=self.config.get("dbpedia", "sparql_url"),
-                cache=DataCache(self.config.get("data", "subject_path")),
-            ),
+    @classmethod
+    def to_edgelist(cls, xs: List[mytypes.PipelineResult]) -> List[mytypes.Edge]:
+        return list(cls.iter_edges(xs))
+
+    def __call__(self, articles, **kwargs) -> CSRGraph:
+        pipeline = Pipeline.from_config(
+            self.config,
+            revision_extractor(self.config),
+            wikitext_extractor(self.config),
+            surface_term_extractor(self.config),
+            subject_extractor(self.config),
             WikipediaCategorySampler(
                 url=self.config.get("wikipedia", "endpoint"),
-                cache=DataCache(self.config.get("data", "category_path")),
+                cache=DataCache.from_config(self.config, "category_path"),
+                concurrency=self.config.get("wikipedia", "concurrency") or 4,
             ),
+            stream=True,
+            retain=(2, 3, 4),
         )
 
-        def reconnect(surface_to_categories, category_to_pagesample):
-            to_return = defaultdict(set)
-            for surface_term, categories in surface_to_categories:
-                for category_i in categories:
-                    for category_j, pagesample in category_to_pagesample:
-                        if category_j == category_i:
-                            to_return[surface_term].update(pagesample)
-
-            return [(subject, list(pages)) for subject, pages in to_return.items()]
+        Pipeline.drain(pipeline.run(articles))
 
-        pipeline.run(articles)
-
-        surface_categorysample = reconnect(pipeline.steps[3][1], pipeline.steps[4][1])
-        surface_categorysample = [
+        # surface term -> pages sampled from its categories, joined lazily so
+        # the pairs go straight into the edge list. The join is deliberately
+        # not a checkpointed step: it needs the complete category samples
+        # before its first output, its inputs come from the caches of the
+        # steps above on a rerun, and keying a checkpoint on those samples
+        # would hash as much data as the join itself touches.
+        join = CategoryJoin(pipeline.steps[4][1])
+        surface_categorysample = (
             (
                 "http://dbpedia.org/resource/" + surface_term.replace(" ", "_"),
                 page_sample,
             )
-            for surface_term, page_sample in surface_categorysample
-        ]
+            for surface_term, page_sample in join.run(pipeline.steps[3][1])
+        )
 
-        articles_surface = self.to_edgelist(pipeline.steps[2][1])
-        resource_category = self.to_edgelist(pipeline.steps[3][1])
-        resource_category = [
+        articles_surface = self.iter_edges(pipeline.steps[2][1])
+        resource_category = (
             ("http://dbpedia.org/resource/" + resource.replace(" ", "_"), category)
-            for resource, category in resource_category
-        ]
-        categorie_subpages = self.to_edgelist(surface_categorysample)
+            for resource, category in self.iter_edges(pipeline.steps[3][1])
+        )
+        categorie_subpages = self.iter_edges(surface_categorysample)
 
-        all_edges = [*articles_surface, *resource_category, *categorie_subpages]
-        # all_edges = [*articles_surface, *resource_category]
+        # the edges are interned as they stream by, never held as tuples
+        return CSRGraph.from_edges(
+            it.chain(articles_surface, resource_category, categorie_subpages)
+        )
 
-        graph = KnowledgeGraph.TupleList(all_edges)
-        graph = graph.simplify()
-        return graph
+
+# per-process state of the ProfileBuilder walks, set up once per worker by
+# _init_walker instead of being shipped with every task
+_walk_graph: CSRGraph | None = None
+_walk_names: List[str] = []
+
+
+def _init_walker(graph: CSRGraph, reseed: bool = False):
+    global _walk_graph, _walk_names
+    _walk_graph = graph
+    _walk_names = graph.names.names()
+    if reseed:
+        # forked workers would otherwise all walk with the parent's random
+        # state; the parent keeps its own, so a seed set by the caller holds
+        random.seed()
 
 
 class ProfileBuilder(object):
-    def __init__(self):
-        pass
+    """Profiles of start articles: the articles visited by a random walk of
+    ``WALK_STEPS`` steps from each.
+
+    Walks run on a pool of ``workers`` processes, kept open across calls
+    until :py:meth:`close`. Each worker receives the graph once, through the
+    pool initializer, which is cheap for a graph loaded from disk as the
+    workers share its memory-mapped arrays, and start articles are dispatched
+    to them in chunks.
+    """
+
+    checkpoint = True
+
+    WALK_STEPS = 40
+
+    def __init__(self, graph: CSRGraph | None = None, workers: int = 4):
+        self.graph = graph
+        self.workers = max(1, workers)
+        self._pool = None
+
+    def checkpoint_config(self):
+        # walks are only reusable on the graph they were taken on, keyed by
+        # its content since a rebuilt graph can keep its size
+        return {"graph": self.graph.digest(), "walk_steps": self.WALK_STEPS}
+
+    def run(self, articles):
+        return self(articles)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    @staticmethod
+    def random_walk(graph: CSRGraph, start: int, steps: int) -> List[int]:
+        """Vertices of a walk of ``steps`` steps from ``start``, including it.
+        Raises a :py:class:`ValueError` when it reaches a vertex without
+        neighbours."""
+        walk = [start]
+        vertex = start
+        for _ in range(steps):
+            low, high = int(graph.indptr[vertex]), int(graph.indptr[vertex + 1])
+            if low == high:
+                raise ValueError("Random walk got stuck at vertex {}".format(vertex))
+            vertex = int(graph.indices[random.randrange(low, high)])
+            walk.append(vertex)
+        return walk
 
     @staticmethod
-    def random_articles(g: KnowledgeGraph, start: str):
-        start_v = g.vs.find(start)
+    def random_articles(start: str):
+        start_v = _walk_graph.names.index(start)
         try:
-            results = g.random_walk(start_v, steps=40, stuck="error")
-        except Exception as e:
-            print(e)
+            results = ProfileBuilder.random_walk(
+                _walk_graph, start_v, ProfileBuilder.WALK_STEPS
+            )
+        except ValueError as e:
+            logging.getLogger("main").warning("{}: {}".format(start, e))
             results = []
 
         # filter out starting vertex
-        results = [x for x in results if g.vs[x]["name"] != start_v["name"]]
-        results = [g.vs[x]["name"] for x in results]
+        results = [_walk_names[x] for x in results if x != start_v]
         results = filter(lambda x: not x.startswith(("Category:")), results)
         return start, list(set(results))
 
-    def __call__(self, g: KnowledgeGraph, articles, nproc=4, **kwargs):
-        with Pool(nproc) as p:
-            res = p.starmap(self.random_articles, zip(it.repeat(g), articles))
+    def __call__(self, articles, **kwargs):
+        articles = list(articles)
+        if self.workers <= 1 or len(articles) < 2:
+            if _walk_graph is not self.graph:
+                _init_walker(self.graph)
+            return [self.random_articles(article) for article in articles]
 
-        return res
+        if self._pool is None:
+            self._pool = Pool(
+                self.workers, initializer=_init_walker, initargs=(self.graph, True)
+            )
+        return self._pool.map(
+            self.random_articles,
+            articles,
+            chunksize=chunk_size(len(articles), self.workers),
+        )
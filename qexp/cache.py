@@ -1,6 +1,13 @@
-import inspect
+import collections
+import gzip
+import itertools as it
 import logging
+import mmap
 import os
+import sqlite3
+import sys
+import threading
+import time
 import typing
 
 
@@ -8,20 +15,94 @@ class KeyNotFoundError(Exception):
     pass
 
 
-class DataCache(object):
-    def __init__(self, cache_dir: str):
-        self.cache_dir = cache_dir
-        self.logger = logging.getLogger("main")
+class UnknownBackendError(Exception):
+    pass
+
+
+class CompressionError(Exception):
+    pass
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise CompressionError("zstd compression requires the zstandard package")
+    return zstandard
+
+
+# Compressed values are prefixed with a NUL byte, which never starts cached
+# text, followed by one byte naming the codec. Anything else is plain UTF-8,
+# so entries written before compression was enabled stay readable.
+MARKER = b"\x00"
+CODECS: typing.Dict[str, typing.Tuple[bytes, typing.Callable, typing.Callable]] = {
+    "gzip": (
+        b"g",
+        lambda data: gzip.compress(data, compresslevel=6),
+        gzip.decompress,
+    ),
+    "zstd": (
+        b"z",
+        lambda data: _zstd().ZstdCompressor(level=10).compress(data),
+        lambda data: _zstd().ZstdDecompressor().decompress(data),
+    ),
+}
+_CODEC_IDS = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+# read-only bytes-like value handed out by the buffer read path
+Buffer = bytes | mmap.mmap
 
-        if not os.path.exists(self.cache_dir):
-            self.logger.info("Creating cache dir {}".format(self.cache_dir))
-            os.mkdir(self.cache_dir)
 
-    def info(self, msg):
-        frm = inspect.stack()[2]
-        mod = inspect.getmodule(frm[0])
-        line_no = inspect.getlineno(frm[0])
-        self.logger.debug("[{}] {} on line {}".format(mod.__name__, msg, line_no))
+def codec_of(raw: Buffer | str) -> str | None:
+    """Name of the codec ``raw`` was stored with, ``None`` for plain text."""
+    if not isinstance(raw, str) and raw[:1] == MARKER:
+        return _CODEC_IDS[raw[1:2]]
+    return None
+
+
+def encode(value: str, compression: str | None = None) -> bytes:
+    data = value.encode("utf-8")
+    if compression is None:
+        return data
+    codec_id, compress, _ = CODECS[compression]
+    return MARKER + codec_id + compress(data)
+
+
+def decode(raw: bytes | str) -> str:
+    # older SQLite caches stored values as TEXT
+    if isinstance(raw, str):
+        return raw
+    codec = codec_of(raw)
+    if codec is None:
+        return raw.decode("utf-8")
+    return CODECS[codec][2](raw[2:]).decode("utf-8")
+
+
+def decode_buffer(raw: Buffer | str) -> Buffer:
+    """Like :py:func:`decode`, but leave the UTF-8 bytes undecoded so plain
+    entries can be handed out without a copy."""
+    if isinstance(raw, str):
+        return raw.encode("utf-8")
+    codec = codec_of(raw)
+    if codec is None:
+        return raw
+    return CODECS[codec][2](raw[2:])
+
+
+class FileStorage(object):
+    """One file per key in a flat directory; the original cache layout.
+
+    Entries are written to a file under ``PARTIAL_DIR`` and renamed into
+    place, so an interrupted write never leaves a truncated entry behind.
+    """
+
+    # smaller files are cheaper to read() than to map
+    MMAP_THRESHOLD = 64 * 1024
+    # a directory, so keys() does not list the files being written
+    PARTIAL_DIR = ".partial"
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
 
     @staticmethod
     def _escape_key(key: str) -> str:
@@ -29,23 +110,582 @@ class DataCache(object):
             return key.replace("/", "||")
         return key
 
-    def get(self, key: str) -> str | None:
-        self.info("called DataCache.get")
-        key = self._escape_key(key)
-        path = os.path.join(self.cache_dir, key)
-        if not os.path.exists(path):
-            self.logger.debug("key {} not found".format(key))
+    @staticmethod
+    def _unescape_key(key: str) -> str:
+        return key.replace("||", "/")
+
+    def get(self, key: str) -> bytes | None:
+        path = os.path.join(self.cache_dir, self._escape_key(key))
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
             return None
 
-        with open(path, "r") as f:
-            return f.read()
+    def get_buffer(self, key: str) -> Buffer | None:
+        path = os.path.join(self.cache_dir, self._escape_key(key))
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < self.MMAP_THRESHOLD:
+                    return f.read()
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
 
-    def set(self, key: str, value: typing.Any) -> typing.Any:
-        self.info("called DataCache.set")
-        key = self._escape_key(key)
+    def set(self, key: str, value: bytes):
+        partial_dir = os.path.join(self.cache_dir, self.PARTIAL_DIR)
+        os.makedirs(partial_dir, exist_ok=True)
+        # one entry at a time per thread, so this name is not shared
+        partial = os.path.join(
+            partial_dir, "{}-{}".format(os.getpid(), threading.get_ident())
+        )
+        try:
+            with open(partial, "wb") as f:
+                f.write(value)
+            os.replace(partial, os.path.join(self.cache_dir, self._escape_key(key)))
+        except BaseException:
+            if os.path.exists(partial):
+                os.unlink(partial)
+            raise
+
+    def get_many(self, keys: typing.Iterable[str]) -> typing.Dict[str, bytes]:
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, items: typing.Iterable[typing.Tuple[str, bytes]]):
+        for key, value in items:
+            self.set(key, value)
+
+    def keys(self) -> typing.Iterator[str]:
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield self._unescape_key(entry.name)
+
+
+class SqliteDatabase(object):
+    """SQLite file shared by the threads and worker processes of a run.
+
+    Each process opens its own connection in WAL mode, running the
+    ``schema`` statements first; threads share it under ``lock``, which
+    callers of :py:meth:`connection` must hold.
+    """
+
+    # stay well below SQLITE_MAX_VARIABLE_NUMBER on older builds
+    CHUNK_SIZE = 500
+
+    def __init__(self, path: str, schema: typing.Sequence[str] = ()):
+        self.path = path
+        self.schema = tuple(schema)
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        # sent to worker processes: they open their own connection
+        return {"path": self.path, "schema": self.schema}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def connection(self) -> sqlite3.Connection:
+        # connections must not be shared across a fork, so reopen per process
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None, timeout=60
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.schema:
+                self._conn.execute(statement)
+            self._pid = os.getpid()
+        return self._conn
+
+    def select_in(self, query: str, keys: typing.Iterable[str]) -> typing.List[tuple]:
+        """Rows of ``query`` for the distinct ``keys``, bound ``CHUNK_SIZE``
+        at a time to the ``IN ({})`` placeholder of the query."""
+        keys = list(dict.fromkeys(keys))
+        rows = []
+        with self.lock:
+            conn = self.connection()
+            for start in range(0, len(keys), self.CHUNK_SIZE):
+                chunk = keys[start : start + self.CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(conn.execute(query.format(placeholders), chunk))
+        return rows
+
+
+class SqliteStorage(object):
+    """All keys of a cache directory in a single indexed SQLite file.
+
+    Bulk reads and writes map to one statement per chunk of keys instead of
+    one open/close per key.
+    """
+
+    FILENAME = "cache.sqlite"
+
+    def __init__(self, cache_dir: str):
+        self.path = os.path.join(cache_dir, self.FILENAME)
+        self._db = SqliteDatabase(
+            self.path,
+            [
+                "CREATE TABLE IF NOT EXISTS cache"
+                " (key TEXT PRIMARY KEY, value BLOB NOT NULL)"
+            ],
+        )
+
+    def get(self, key: str) -> bytes | None:
+        with self._db.lock:
+            row = (
+                self._db.connection()
+                .execute("SELECT value FROM cache WHERE key = ?", (key,))
+                .fetchone()
+            )
+        return None if row is None else row[0]
+
+    def get_buffer(self, key: str) -> Buffer | None:
+        return self.get(key)
+
+    def set(self, key: str, value: bytes):
+        self.set_many([(key, value)])
+
+    def get_many(self, keys: typing.Iterable[str]) -> typing.Dict[str, bytes]:
+        return dict(
+            self._db.select_in("SELECT key, value FROM cache WHERE key IN ({})", keys)
+        )
+
+    def set_many(self, items: typing.Iterable[typing.Tuple[str, bytes]]):
+        with self._db.lock:
+            conn = self._db.connection()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", items
+                )
+
+    def keys(self) -> typing.Iterator[str]:
+        with self._db.lock:
+            rows = self._db.connection().execute("SELECT key FROM cache").fetchall()
+        for (key,) in rows:
+            yield key
+
+
+class LatencyHistogram(object):
+    """Power-of-two histogram of call latencies, bucketed in microseconds."""
+
+    BUCKETS = 24  # the last bucket collects everything above ~8s
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total_ns = 0
+
+    def record(self, elapsed_ns: int):
+        self.total_ns += elapsed_ns
+        bucket = min((elapsed_ns // 1000).bit_length(), self.BUCKETS - 1)
+        self.counts[bucket] += 1
+
+    def merge(self, other: "LatencyHistogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total_ns += other.total_ns
 
-        self.logger.debug("setting cache-key {}".format(key))
-        with open(os.path.join(self.cache_dir, key), "w") as f:
-            f.write(value)
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
 
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q``-th percentile, in ms."""
+        total = self.count
+        if total == 0:
+            return 0.0
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= q / 100 * total:
+                return (1 << bucket) / 1000
+        return (1 << (self.BUCKETS - 1)) / 1000
+
+    def summary(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "count": self.count,
+            "total_ms": self.total_ns / 1e6,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "buckets_us": {
+                (1 << bucket): n for bucket, n in enumerate(self.counts) if n
+            },
+        }
+
+
+class CacheMetrics(object):
+    """Counters for one cache directory.
+
+    Sizes are bytes as stored, i.e. after compression. Threads share the
+    counters of a directory, so they are only updated through the
+    ``record_*`` methods and :py:meth:`merge`, under a lock.
+    """
+
+    COUNTERS = ("hits", "memory_hits", "misses", "bytes_read", "bytes_written")
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.get_latency = LatencyHistogram()
+        self.set_latency = LatencyHistogram()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k != "_lock"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def record_get(
+        self,
+        elapsed_ns: int,
+        hits: int,
+        misses: int,
+        memory_hits: int = 0,
+        bytes_read: int = 0,
+    ):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.memory_hits += memory_hits
+            self.bytes_read += bytes_read
+            self.get_latency.record(elapsed_ns)
+
+    def record_set(self, elapsed_ns: int, bytes_written: int):
+        with self._lock:
+            self.bytes_written += bytes_written
+            self.set_latency.record(elapsed_ns)
+
+    def merge(self, other: "CacheMetrics"):
+        """Add the counts of ``other``, e.g. those of a worker process."""
+        with self._lock:
+            for counter in self.COUNTERS:
+                setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+            self.get_latency.merge(other.get_latency)
+            self.set_latency.merge(other.set_latency)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "cache_dir": self.cache_dir,
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "get_latency": self.get_latency.summary(),
+            "set_latency": self.set_latency.summary(),
+        }
+
+    def __str__(self):
+        return (
+            "{}: {} hits ({} from memory), {} misses ({:.1%} hit ratio),"
+            " read {:.1f} MB,"
+            " wrote {:.1f} MB, get p50/p99 {:.3f}/{:.3f} ms over {} calls,"
+            " set p50/p99 {:.3f}/{:.3f} ms over {} calls".format(
+                self.cache_dir,
+                self.hits,
+                self.memory_hits,
+                self.misses,
+                self.hit_ratio,
+                self.bytes_read / 1e6,
+                self.bytes_written / 1e6,
+                self.get_latency.percentile(50),
+                self.get_latency.percentile(99),
+                self.get_latency.count,
+                self.set_latency.percentile(50),
+                self.set_latency.percentile(99),
+                self.set_latency.count,
+            )
+        )
+
+
+class MemoryTier(object):
+    """Byte-bounded LRU of cache values kept in process memory.
+
+    Sizes are measured with ``sys.getsizeof``, so the budget reflects the
+    memory actually held by the cached objects.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.evictions = 0
+        self._entries: collections.OrderedDict[str, typing.Any] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # worker processes start with an empty tier of the same budget
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_bytes"])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> typing.Any | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: typing.Any):
+        size = sys.getsizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= sys.getsizeof(old)
+            # the old value is dropped even if the new one does not fit
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = value
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= sys.getsizeof(evicted)
+                self.evictions += 1
+
+    def __str__(self):
+        return "{} entries, {:.1f} of {:.1f} MB, {} evictions".format(
+            len(self), self.nbytes / 1e6, self.max_bytes / 1e6, self.evictions
+        )
+
+
+class DataCache(object):
+    BACKENDS = {
+        "file": FileStorage,
+        "sqlite": SqliteStorage,
+    }
+
+    # counters and memory tiers are per directory, shared by every instance
+    # using it
+    _metrics: typing.Dict[str, CacheMetrics] = {}
+    _memory_tiers: typing.Dict[str, MemoryTier] = {}
+
+    def __init__(
+        self,
+        cache_dir: str,
+        backend: str = "file",
+        memory_bytes: int = 0,
+        compression: str | None = None,
+    ):
+        self.cache_dir = cache_dir
+        self.backend = backend
+        self.compression = compression
+        self.logger = logging.getLogger("main")
+
+        if not os.path.exists(self.cache_dir):
+            self.logger.info("Creating cache dir {}".format(self.cache_dir))
+            os.mkdir(self.cache_dir)
+
+        try:
+            self.storage = self.BACKENDS[backend](cache_dir)
+        except KeyError:
+            raise UnknownBackendError(
+                "Unknown cache backend {!r}, expected one of {}".format(
+                    backend, ", ".join(self.BACKENDS)
+                )
+            )
+
+        if compression is not None and compression not in CODECS:
+            raise CompressionError(
+                "Unknown compression {!r}, expected one of {}".format(
+                    compression, ", ".join(CODECS)
+                )
+            )
+
+        key = os.path.normpath(cache_dir)
+        if key not in self._metrics:
+            self._metrics[key] = CacheMetrics(key)
+        self.metrics: CacheMetrics = self._metrics[key]
+
+        self.memory: MemoryTier | None = None
+        if memory_bytes > 0:
+            if key not in self._memory_tiers:
+                self._memory_tiers[key] = MemoryTier(memory_bytes)
+            self.memory = self._memory_tiers[key]
+
+    @classmethod
+    def from_config(cls, config, option: str) -> "DataCache":
+        """Create the cache for the directory stored under ``[data] option``,
+        using the storage settings of the ``[cache]`` section."""
+        return cls(
+            config.get("data", option),
+            backend=config.get("cache", "backend") or "file",
+            memory_bytes=config.get("cache", "memory_bytes") or 0,
+            compression=(config.get("cache", "compression") or {}).get(option),
+        )
+
+    @classmethod
+    def all_metrics(cls) -> typing.List[CacheMetrics]:
+        return list(cls._metrics.values())
+
+    @classmethod
+    def log_metrics(cls):
+        logger = logging.getLogger("main")
+        for key, metrics in cls._metrics.items():
+            logger.info("Cache {}".format(metrics))
+            if key in cls._memory_tiers:
+                logger.info("Memory tier {}: {}".format(key, cls._memory_tiers[key]))
+
+    def get(self, key: str) -> str | None:
+        start = time.perf_counter_ns()
+        value = None
+        memory_hits = bytes_read = 0
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                memory_hits = 1
+        if value is None:
+            raw = self.storage.get(key)
+            if raw is not None:
+                bytes_read = len(raw)
+                value = decode(raw)
+                if self.memory is not None:
+                    self.memory.put(key, value)
+        self.metrics.record_get(
+            time.perf_counter_ns() - start,
+            hits=int(value is not None),
+            misses=int(value is None),
+            memory_hits=memory_hits,
+            bytes_read=bytes_read,
+        )
         return value
+
+    def set(self, key: str, value: typing.Any) -> typing.Any:
+        start = time.perf_counter_ns()
+        raw = encode(value, self.compression)
+        self.storage.set(key, raw)
+        if self.memory is not None:
+            self.memory.put(key, value)
+        self.metrics.record_set(time.perf_counter_ns() - start, len(raw))
+
+        return value
+
+    def get_buffer(self, key: str) -> Buffer | None:
+        """Return the UTF-8 encoded value for ``key`` without decoding it.
+
+        Large uncompressed files are memory-mapped rather than read, so
+        consumers that only scan or tokenize the text never copy it into a
+        Python string. Compressed entries and the SQLite backend have no
+        such path: their values are decompressed or read into a fresh
+        ``bytes``, which still skips the UTF-8 decode. Treat the result as
+        read-only.
+        """
+        start = time.perf_counter_ns()
+        memory_hits = bytes_read = 0
+        if self.memory is not None and (value := self.memory.get(key)) is not None:
+            memory_hits = 1
+            buffer = value.encode("utf-8")
+        else:
+            raw = self.storage.get_buffer(key)
+            if raw is not None:
+                bytes_read = len(raw)
+            buffer = None if raw is None else decode_buffer(raw)
+        self.metrics.record_get(
+            time.perf_counter_ns() - start,
+            hits=int(buffer is not None),
+            misses=int(buffer is None),
+            memory_hits=memory_hits,
+            bytes_read=bytes_read,
+        )
+        return buffer
+
+    def get_many(self, keys: typing.Iterable[str]) -> typing.Dict[str, str]:
+        """Look up several keys at once; missing keys are absent from the result."""
+        keys = set(keys)
+
+        start = time.perf_counter_ns()
+        found = {}
+        if self.memory is not None:
+            for key in keys:
+                value = self.memory.get(key)
+                if value is not None:
+                    found[key] = value
+        memory_hits = len(found)
+
+        fetched = self.storage.get_many(keys.difference(found))
+        for key, raw in fetched.items():
+            found[key] = decode(raw)
+            if self.memory is not None:
+                self.memory.put(key, found[key])
+        self.metrics.record_get(
+            time.perf_counter_ns() - start,
+            hits=len(found),
+            misses=len(keys) - len(found),
+            memory_hits=memory_hits,
+            bytes_read=sum(map(len, fetched.values())),
+        )
+        return found
+
+    def set_many(self, items: typing.Iterable[typing.Tuple[str, str]]):
+        items = list(items)
+
+        start = time.perf_counter_ns()
+        raw_items = [(key, encode(value, self.compression)) for key, value in items]
+        self.storage.set_many(raw_items)
+        if self.memory is not None:
+            for key, value in items:
+                self.memory.put(key, value)
+        self.metrics.record_set(
+            time.perf_counter_ns() - start, sum(len(raw) for _, raw in raw_items)
+        )
+
+    def keys(self) -> typing.Iterator[str]:
+        return self.storage.keys()
+
+    def iter_items(
+        self, keys: typing.Iterable[str], chunk_size: int = 1000
+    ) -> typing.Iterator[typing.Tuple[str, str]]:
+        """Stream ``(key, value)`` pairs for ``keys`` in bulk lookups of
+        ``chunk_size``, skipping keys that are not cached."""
+        keys = iter(keys)
+        while chunk := list(it.islice(keys, chunk_size)):
+            found = self.get_many(chunk)
+            for key in chunk:
+                if key in found:
+                    yield key, found[key]
+
+    def recompress(self, keys: typing.Iterable[str]) -> int:
+        """Rewrite the entries for ``keys`` that are not yet stored with this
+        cache's compression. Returns the number of rewritten entries."""
+        stale = [
+            (key, encode(decode(raw), self.compression))
+            for key, raw in self.storage.get_many(keys).items()
+            if codec_of(raw) != self.compression
+        ]
+        self.storage.set_many(stale)
+        return len(stale)
+
+    def iter_buffers(
+        self, keys: typing.Iterable[str]
+    ) -> typing.Iterator[typing.Tuple[str, Buffer]]:
+        """Stream ``(key, buffer)`` pairs as returned by :py:meth:`get_buffer`,
+        skipping keys that are not cached."""
+        for key in keys:
+            buffer = self.get_buffer(key)
+            if buffer is not None:
+                yield key, buffer
@@ -35,7 +35,8 @@ class Config(object):
     def get(self, section: str, option: str) -> Any:
         # simply delegate to the underlying config object
         try:
-            section = self.config.get(section)
+            # a missing section reads as empty, like a missing option
+            section = self.config.get(section) or {}
             option = section.get(option)
             return option
         except KeyError as e:
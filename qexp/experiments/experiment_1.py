@@ -9,7 +9,7 @@ import sys
 import typing
 from pathlib import Path
 
-from qexp import Config
+from qexp import Config, DataCache
 from qexp.expand import ModelRegistry
 from qexp.experiments.searcher import Searcher
 from qexp.experiments.types import Result, SearchSpecsBuilder
@@ -55,10 +55,10 @@ def main(args):
         w = csv.writer(f)
         w.writerow(Result.HEADER)
 
-    for parent_title, files in files_per_split.items():
-        collection = [Path(config.get("data", "clean_path")) / file for file in files]
+    cache = DataCache.from_config(config, "clean_path")
 
-        search = Search(collection=collection)
+    for parent_title, files in files_per_split.items():
+        search = Search(collection=cache.iter_items(files))
 
         search_specs = SearchSpecsBuilder(config.get("data", "search_config"))
         search_specs = [
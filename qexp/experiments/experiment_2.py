@@ -3,6 +3,7 @@ import csv
 import os
 from pathlib import Path
 
+from qexp import DataCache
 from qexp.expand import ModelRegistry
 from qexp.experiments.searcher import Searcher
 from qexp.experiments.types import Result, SearchSpecsBuilder
@@ -14,7 +15,8 @@ def main(args: argparse.Namespace):
     model_path = args.model_path
     results_path = args.results_path
 
-    search = Search(collection=Path(config.get("data", "clean_path")).glob("*"))
+    cache = DataCache.from_config(config, "clean_path")
+    search = Search(collection=cache.iter_items(cache.keys(), chunk_size=50))
     registry = ModelRegistry(Path(model_path))
 
     search_specs = SearchSpecsBuilder(config.get("data", "search_config"))
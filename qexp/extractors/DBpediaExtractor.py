@@ -0,0 +1,207 @@
+import bz2
+import gzip
+import itertools as it
+import logging
+import os
+import re
+import typing
+
+from qexp.cache import DataCache, SqliteDatabase
+from qexp.extractors.SparqlExtractor import SubjectExtractor, WikiPageIdExtractor
+
+RDFS_LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+DCT_SUBJECT = "http://purl.org/dc/terms/subject"
+WIKI_PAGE_ID = "http://dbpedia.org/ontology/wikiPageID"
+
+# subject, predicate and either an IRI or a literal object of an N-Triples line
+TRIPLE = re.compile(
+    r'<([^>]*)> <([^>]*)> (?:<([^>]*)>|"((?:[^"\\]|\\.)*)"(?:@([\w-]+))?)'
+)
+ESCAPE = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))")
+ESCAPES = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f"}
+
+
+def _unescape(literal: str) -> str:
+    def replace(match: re.Match) -> str:
+        code = match.group(1) or match.group(2)
+        if code:
+            return chr(int(code, 16))
+        return ESCAPES.get(match.group(3), match.group(3))
+
+    return ESCAPE.sub(replace, literal) if "\\" in literal else literal
+
+
+def read_triples(path: str, predicate: str) -> typing.Iterator[typing.Tuple[str, str]]:
+    """``(subject, object)`` pairs of the ``predicate`` triples in an
+    N-Triples file (plain, .gz or .bz2), keeping only English literals."""
+    opener = {".bz2": bz2.open, ".gz": gzip.open}.get(os.path.splitext(path)[1], open)
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            match = TRIPLE.match(line)
+            if match is None or match.group(2) != predicate:
+                continue
+            subject, _, iri, literal, lang = match.groups()
+            if iri is not None:
+                yield subject, iri
+            elif lang in (None, "en"):
+                yield subject, _unescape(literal)
+
+
+class DBpediaStore(object):
+    """Labels, ``dct:subject`` and ``wikiPageID`` triples of a DBpedia
+    release in a single indexed SQLite file, see ``main.py dbpedia``."""
+
+    TABLES = {
+        "labels": (RDFS_LABEL, "label TEXT NOT NULL, resource TEXT NOT NULL", "label"),
+        "subjects": (
+            DCT_SUBJECT,
+            "resource TEXT NOT NULL, subject TEXT NOT NULL",
+            "resource",
+        ),
+        "page_ids": (
+            WIKI_PAGE_ID,
+            "resource TEXT NOT NULL, page_id TEXT NOT NULL",
+            "resource",
+        ),
+    }
+    INSERT_CHUNK_SIZE = 100_000
+
+    def __init__(self, path: str):
+        self.path = path
+        self.logger = logging.getLogger("main")
+        self._db = SqliteDatabase(
+            path,
+            [
+                "CREATE TABLE IF NOT EXISTS {} ({})".format(table, columns)
+                for table, (_, columns, _) in self.TABLES.items()
+            ],
+        )
+
+    def ingest(self, table: str, path: str) -> int:
+        """Replace the rows of ``table`` with the matching triples of the
+        N-Triples file at ``path``. Returns the number of rows."""
+        predicate, _, indexed = self.TABLES[table]
+        pairs = read_triples(path, predicate)
+        if table == "labels":
+            # looked up by label, so store the object first
+            pairs = ((label, resource) for resource, label in pairs)
+
+        rows = 0
+        with self._db.lock:
+            conn = self._db.connection()
+            conn.execute("DROP INDEX IF EXISTS {}_{}".format(table, indexed))
+            conn.execute("DELETE FROM {}".format(table))
+            while chunk := list(it.islice(pairs, self.INSERT_CHUNK_SIZE)):
+                with conn:
+                    conn.execute("BEGIN")
+                    conn.executemany(
+                        "INSERT INTO {} VALUES (?, ?)".format(table), chunk
+                    )
+                rows += len(chunk)
+                self.logger.info("Ingested {} {}".format(rows, table))
+            # building the index once after the load is much faster than
+            # maintaining it during the inserts
+            conn.execute("CREATE INDEX {0}_{1} ON {0} ({1})".format(table, indexed))
+        return rows
+
+    def subjects(
+        self, labels: typing.Iterable[str]
+    ) -> typing.Dict[str, typing.List[str]]:
+        """``dct:subject`` URIs of the resources carrying each label."""
+        found: typing.Dict[str, typing.List[str]] = {}
+        for label, subject in self._db.select_in(
+            "SELECT DISTINCT labels.label, subjects.subject FROM labels"
+            " JOIN subjects ON subjects.resource = labels.resource"
+            " WHERE labels.label IN ({})",
+            labels,
+        ):
+            found.setdefault(label, []).append(subject)
+        return found
+
+    def page_ids(self, resources: typing.Iterable[str]) -> typing.Dict[str, str]:
+        """Wikipedia page ID of each resource URI."""
+        found: typing.Dict[str, str] = {}
+        for resource, page_id in self._db.select_in(
+            "SELECT resource, page_id FROM page_ids WHERE resource IN ({})",
+            resources,
+        ):
+            found.setdefault(resource, page_id)
+        return found
+
+
+class BaseDBpediaExtractor(object):
+    def __init__(self, store_path: str):
+        if not os.path.exists(store_path):
+            raise FileNotFoundError(
+                "DBpedia store {} does not exist, ingest it with"
+                " `main.py dbpedia`".format(store_path)
+            )
+        self.store_path = store_path
+        self.store = DBpediaStore(store_path)
+        self.logger = logging.getLogger("main")
+
+
+class DBpediaSubjectExtractor(BaseDBpediaExtractor):
+    """:py:class:`SubjectExtractor` answered from a local
+    :py:class:`DBpediaStore`."""
+
+    def run(self, items: typing.Iterable[str]) -> typing.List[typing.Tuple[str, str]]:
+        labels = SubjectExtractor.labels(items)
+        found = {
+            label: [
+                subject.removeprefix("http://dbpedia.org/resource/")
+                for subject in subjects[: SubjectExtractor.SUBJECTS_PER_LABEL]
+            ]
+            for label, subjects in self.store.subjects(labels).items()
+        }
+
+        return [(label, found[label]) for label in labels if label in found]
+
+
+class DBpediaPageIdExtractor(BaseDBpediaExtractor):
+    """:py:class:`WikiPageIdExtractor` answered from a local
+    :py:class:`DBpediaStore`, without Redis."""
+
+    def run(
+        self, items: typing.Iterable[typing.Tuple[str, typing.List[str]]]
+    ) -> typing.List[typing.Tuple[str, typing.List[str]]]:
+        items = list(items)
+        ids = self.store.page_ids(alter for _, alters in items for alter in alters)
+
+        to_return = []
+        for start_id, alters in items:
+            new_alters = []
+            for alter in alters:
+                if alter in ids:
+                    new_alters.append(ids[alter])
+                elif not alter.startswith("http://"):
+                    new_alters.append(alter)
+            to_return.append((start_id, new_alters))
+
+        return to_return
+
+
+def subject_extractor(config) -> DBpediaSubjectExtractor | SubjectExtractor:
+    """The subject lookup configured in ``[dbpedia]``: the local store if
+    ``resolver = "dump"``, the SPARQL endpoint otherwise."""
+    if config.get("dbpedia", "resolver") == "dump":
+        return DBpediaSubjectExtractor(config.get("dbpedia", "store_path"))
+    return SubjectExtractor(
+        endpoint=config.get("dbpedia", "sparql_url"),
+        cache=DataCache.from_config(config, "subject_path"),
+        batch_size=config.get("dbpedia", "sparql_batch_size") or 50,
+    )
+
+
+def page_id_extractor(config) -> DBpediaPageIdExtractor | WikiPageIdExtractor:
+    """The page ID lookup configured in ``[dbpedia]``: the local store if
+    ``resolver = "dump"``, the SPARQL endpoint and Redis otherwise."""
+    if config.get("dbpedia", "resolver") == "dump":
+        return DBpediaPageIdExtractor(config.get("dbpedia", "store_path"))
+    return WikiPageIdExtractor(
+        endpoint=config.get("dbpedia", "sparql_url"),
+        redis_host=config.get("redis", "host") or "localhost",
+        redis_port=config.get("redis", "port") or 6379,
+        redis_db=config.get("redis", "db") or 0,
+        batch_size=config.get("dbpedia", "sparql_batch_size") or 50,
+    )
@@ -0,0 +1,147 @@
+import bz2
+import gzip
+import logging
+import re
+import typing
+from collections import defaultdict
+
+from qexp.cache import DataCache
+from qexp.extractors.SpotlightExtractor import SpotlightExtractor
+
+TOKEN = re.compile(r"\w+")
+
+
+def normalize(text: str) -> typing.List[str]:
+    """Tokens of ``text`` as matched against the lexicon: runs of word
+    characters, so punctuation and spacing never prevent a match."""
+    return TOKEN.findall(text)
+
+
+class Lexicon(object):
+    """Surface form to DBpedia resource mapping, matched on whole tokens.
+
+    Built from a ``surface form<TAB>URI<TAB>count`` file such as the
+    ``pairCounts`` of a Spotlight model. A surface form is only kept if its
+    most frequent URI accounts for at least ``confidence`` of its links.
+    """
+
+    def __init__(self, path: str, confidence: float):
+        self.path = path
+        self.confidence = confidence
+        # "Token Token" -> URI, plus the longest surface form (in tokens) per
+        # first token, which bounds the lookahead at each position
+        self.forms: typing.Dict[str, str] = {}
+        self.max_tokens: typing.Dict[str, int] = {}
+        self._load()
+
+    def __len__(self):
+        return len(self.forms)
+
+    def _load(self):
+        counts: typing.Dict[str, typing.Dict[str, int]] = defaultdict(dict)
+        opener = {".bz2": bz2.open, ".gz": gzip.open}.get(
+            self.path[self.path.rfind(".") :], open
+        )
+        with opener(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 2:
+                    continue
+                tokens = normalize(fields[0])
+                if not tokens:
+                    continue
+                count = int(fields[2]) if len(fields) > 2 and fields[2] else 1
+                form = " ".join(tokens)
+                counts[form][fields[1]] = counts[form].get(fields[1], 0) + count
+
+        for form, uris in counts.items():
+            uri, count = max(uris.items(), key=lambda item: item[1])
+            if count / sum(uris.values()) < self.confidence:
+                continue
+            self.forms[form] = uri
+            first, _, _ = form.partition(" ")
+            n_tokens = form.count(" ") + 1
+            if n_tokens > self.max_tokens.get(first, 0):
+                self.max_tokens[first] = n_tokens
+
+    def annotate(self, text: str) -> typing.Set[str]:
+        """URIs of the leftmost-longest, non-overlapping surface forms in
+        ``text``."""
+        tokens = normalize(text)
+        uris = set()
+        i = 0
+        while i < len(tokens):
+            longest = self.max_tokens.get(tokens[i], 0)
+            for n in range(min(longest, len(tokens) - i), 0, -1):
+                uri = self.forms.get(" ".join(tokens[i : i + n]))
+                if uri is not None:
+                    uris.add(uri)
+                    i += n
+                    break
+            else:
+                i += 1
+        return uris
+
+
+class LexiconExtractor(object):
+    """In-process replacement for :py:class:`SpotlightExtractor` that links
+    surface forms through a :py:class:`Lexicon` instead of the Spotlight
+    service.
+    """
+
+    # lexicons are large and read-only, so they are loaded once per process
+    # and shared by every instance using them
+    _lexicons: typing.Dict[typing.Tuple[str, float], Lexicon] = {}
+
+    def __init__(self, lexicon_path: str, cache: DataCache, confidence: float = 0.6):
+        self.lexicon_path = lexicon_path
+        self.confidence = confidence
+        self.cache = cache
+        self.logger = logging.getLogger("main")
+
+        key = (lexicon_path, confidence)
+        if key not in self._lexicons:
+            self.logger.info("Loading lexicon {}".format(lexicon_path))
+            self._lexicons[key] = Lexicon(lexicon_path, confidence)
+            self.logger.info("Loaded {} surface forms".format(len(self._lexicons[key])))
+        self.lexicon = self._lexicons[key]
+
+    def run(self, items: typing.Iterable) -> typing.List[typing.Tuple[str, str]]:
+        to_return = []
+        items = list(items)
+        cached = self.cache.get_many(article_id for article_id, _ in items)
+        annotated = {}
+        for article_id, clean_text in items:
+            if article_id in cached or article_id in annotated:
+                continue
+            annotated[article_id] = sorted(self.lexicon.annotate(clean_text))
+
+        self.cache.set_many(
+            (article_id, ";".join(uris)) for article_id, uris in annotated.items()
+        )
+
+        for article_id, _ in items:
+            if article_id in annotated:
+                to_return.append((article_id, annotated[article_id]))
+            elif cached[article_id]:
+                to_return.append((article_id, cached[article_id].split(";")))
+            else:
+                to_return.append((article_id, []))
+
+        return to_return
+
+
+def surface_term_extractor(config) -> LexiconExtractor | SpotlightExtractor:
+    """The entity linker configured in ``[dbpedia]``: the in-process lexicon
+    if ``linker = "lexicon"``, the Spotlight service otherwise."""
+    if config.get("dbpedia", "linker") == "lexicon":
+        return LexiconExtractor(
+            lexicon_path=config.get("dbpedia", "lexicon_path"),
+            cache=DataCache.from_config(config, "lexicon_term_path"),
+            confidence=config.get("dbpedia", "lexicon_confidence") or 0.6,
+        )
+    return SpotlightExtractor(
+        url=config.get("dbpedia", "url"),
+        cache=DataCache.from_config(config, "surface_term_path"),
+        concurrency=config.get("dbpedia", "spotlight_concurrency") or 4,
+    )
@@ -5,6 +5,8 @@ from qexp import types
 
 
 class Sampler(object):
+    checkpoint = True
+
     def __init__(self, sample_size: int):
         self.sample_size = sample_size
 
@@ -1,139 +1,315 @@
 import logging
-import random
 import time
 import typing
+import urllib.error
 
 import redis
-from SPARQLWrapper import JSON, SPARQLWrapper
+from SPARQLWrapper import JSON, POST, SPARQLWrapper
+from SPARQLWrapper.SPARQLExceptions import EndPointInternalError
 
 from qexp import DataCache
 
 
+class SparqlError(SystemError):
+    pass
+
+
+class AdaptiveThrottle(object):
+    """Delay between requests to an endpoint, doubled whenever it pushes back
+    and halved after every request it serves, so a healthy endpoint is
+    queried back to back."""
+
+    MIN_DELAY = 0.25
+    MAX_DELAY = 60.0
+
+    def __init__(self):
+        self.delay = 0.0
+
+    def wait(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def success(self):
+        self.delay = self.delay / 2 if self.delay / 2 >= self.MIN_DELAY else 0.0
+
+    def failure(self, retry_after: float = 0.0):
+        self.delay = min(
+            self.MAX_DELAY, max(self.MIN_DELAY, self.delay * 2, retry_after)
+        )
+
+
 class BaseSparqlExtractor(object):
+    MAX_RETRIES = 6
+    # the endpoint is overloaded or restarting, rather than rejecting the query
+    RETRY_STATUS = (429, 502, 503, 504)
+
     def __init__(self, endpoint: str, cache: DataCache):
         self.sparql = SPARQLWrapper(endpoint)
         self.sparql.setReturnFormat(JSON)
         self.logger = logging.getLogger("main")
         self.cache = cache
+        self.throttle = AdaptiveThrottle()
+
+    def _select(self, query: str) -> typing.List[typing.Dict]:
+        """Bindings of a SELECT query, retried with the throttle backing off
+        while the endpoint is overloaded."""
+        self.sparql.setQuery(query)
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.throttle.wait()
+            try:
+                ret = self.sparql.queryAndConvert()
+            except urllib.error.HTTPError as e:
+                if e.code not in self.RETRY_STATUS:
+                    raise
+                retry_after = e.headers.get("Retry-After", "")
+                self.throttle.failure(int(retry_after) if retry_after.isdigit() else 0)
+                reason = "HTTP {}".format(e.code)
+            except (EndPointInternalError, urllib.error.URLError, TimeoutError) as e:
+                self.throttle.failure()
+                reason = repr(e)
+            else:
+                self.throttle.success()
+                return ret["results"]["bindings"]
+
+            self.logger.warning(
+                "{}, retrying in {:.1f}s ({}/{})".format(
+                    reason, self.throttle.delay, attempt + 1, self.MAX_RETRIES
+                )
+            )
+
+        raise SparqlError(
+            "Giving up after {} retries: {}".format(self.MAX_RETRIES, reason)
+        )
 
 
 class WikiPageIdExtractor(BaseSparqlExtractor):
-    def __init__(self, endpoint: str, cache: DataCache = None):
+    """Resolves DBpedia resource URIs to Wikipedia page IDs, cached in Redis.
+
+    The URIs of all items are deduplicated and looked up in Redis in one
+    pipelined round trip; misses are resolved ``batch_size`` at a time with
+    ``VALUES`` queries and written back in another.
+    """
+
+    # not checkpointed: failed lookups are logged and left out of the output,
+    # which a checkpoint would keep for good, while Redis already holds every
+    # ID that was resolved
+
+    # keys per MGET/MSET command within a pipeline
+    REDIS_CHUNK_SIZE = 1000
+    # characters that cannot appear in a SPARQL IRI reference
+    ILLEGAL_IRI_CHARS = frozenset('<>"{}|^`\\ ')
+
+    def __init__(
+        self,
+        endpoint: str,
+        cache: DataCache = None,
+        redis_host: str = "localhost",
+        redis_port: int = 6379,
+        redis_db: int = 0,
+        batch_size: int = 50,
+    ):
         super().__init__(endpoint, cache)
-        self.redis = redis.Redis(host="localhost", port=6379, decode_responses=True)
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self.redis_db = redis_db
+        self.batch_size = max(1, batch_size)
+        self.redis = redis.Redis(
+            host=redis_host, port=redis_port, db=redis_db, decode_responses=True
+        )
+        self.sparql.setMethod(POST)
 
     def run(
         self, items: typing.Iterable[typing.Tuple[str, typing.List[str]]]
     ) -> typing.List[typing.Tuple[str, typing.List[str]]]:
-        query = """\
-SELECT DISTINCT  ?id
-FROM <http://dbpedia.org>
-WHERE {{
-    <{}> <http://dbpedia.org/ontology/wikiPageID> ?id .
-}}
-LIMIT  1
-        """
+        items = list(items)
+        alters = list(dict.fromkeys(alter for _, xs in items for alter in xs))
+        ids = self._mget(alters)
+        self.logger.info(
+            "Found {} of {} page IDs in Redis".format(len(ids), len(alters))
+        )
+
+        to_fetch = [
+            alter
+            for alter in alters
+            if alter not in ids and alter.startswith("http://")
+        ]
+        fetched = {}
+        for start in range(0, len(to_fetch), self.batch_size):
+            batch = to_fetch[start : start + self.batch_size]
+            self.logger.info("SPARQL ID query for {} URIs".format(len(batch)))
+            try:
+                fetched.update(self._fetch(batch))
+            except Exception as e:
+                self.logger.error(e)
+        self._mset(fetched)
+        ids.update(fetched)
+
         to_return = []
-        for start_id, alters in items:
+        for start_id, xs in items:
             new_alters = []
-            for alter in alters:
-                if self.redis.get(alter):
-                    self.logger.info("Found Redis key")
-                    new_alters.append(self.redis.get(alter))
-                    continue
-
-                if not alter.startswith("http://"):
+            for alter in xs:
+                if alter in ids:
+                    new_alters.append(ids[alter])
+                elif not alter.startswith("http://"):
                     self.logger.debug("skipping")
                     new_alters.append(alter)
-                    continue
+            to_return.append((start_id, new_alters))
 
-                formatted_query = query.format(alter)
-                self.sparql.setQuery(formatted_query)
+        return to_return
 
-                self.logger.info("SPARQL ID query for {}".format(alter))
+    def _mget(self, keys: typing.List[str]) -> typing.Dict[str, str]:
+        pipe = self.redis.pipeline(transaction=False)
+        for start in range(0, len(keys), self.REDIS_CHUNK_SIZE):
+            pipe.mget(keys[start : start + self.REDIS_CHUNK_SIZE])
+        values = [value for chunk in pipe.execute() for value in chunk]
+        return {key: value for key, value in zip(keys, values) if value}
 
-                try:
-                    time.sleep(random.randint(200, 1000) / 1000)
-                    ret = self.sparql.queryAndConvert()
-                    self.redis.set(alter, ret["results"]["bindings"][0]["id"]["value"])
-                    new_alters.append(ret["results"]["bindings"][0]["id"]["value"])
+    def _mset(self, mapping: typing.Dict[str, str]):
+        pipe = self.redis.pipeline(transaction=False)
+        items = list(mapping.items())
+        for start in range(0, len(items), self.REDIS_CHUNK_SIZE):
+            pipe.mset(dict(items[start : start + self.REDIS_CHUNK_SIZE]))
+        pipe.execute()
 
-                except Exception as e:
-                    self.logger.error(e)
-            to_return.append((start_id, new_alters))
+    def _fetch(self, uris: typing.List[str]) -> typing.Dict[str, str]:
+        query = """\
+SELECT  ?concept ?id
+FROM <http://dbpedia.org>
+WHERE {{
+    VALUES ?concept {{ {} }}
+    ?concept <http://dbpedia.org/ontology/wikiPageID> ?id .
+}}
+"""
+        valid = []
+        for uri in uris:
+            if self.ILLEGAL_IRI_CHARS.isdisjoint(uri):
+                valid.append(uri)
+            else:
+                self.logger.error("Cannot query page ID of {}".format(uri))
+        if not valid:
+            return {}
 
-        return to_return
+        ids = {}
+        bindings = self._select(query.format(" ".join(map("<{}>".format, valid))))
+        for res in bindings:
+            # keep the first ID of a resource, as LIMIT 1 per URI did
+            ids.setdefault(res["concept"]["value"], res["id"]["value"])
+        return ids
 
 
 class SubjectExtractor(BaseSparqlExtractor):
-    def __init__(self, endpoint: str, cache: DataCache):
+    """Looks up the dct:subject categories of DBpedia resources by label,
+    ``batch_size`` labels per query."""
+
+    # the LIMIT of the former per-label query
+    SUBJECTS_PER_LABEL = 100
+    # rows per page of a batch query; must not exceed the endpoint's result
+    # cap (ResultSetMaxRows, 10000 on dbpedia.org), or a truncated page is
+    # taken for the last one
+    PAGE_SIZE = 10_000
+
+    blocklist = [
+        "Alcoholic drink",
+        "Federal Insurance Contributions Act tax",
+        "Victor Perez",
+        "Kino International (company)",
+        "The Fabulous Freebirds",
+        "Taps",
+        "The Blade Runners",
+        "Divine Intervention (film)",
+        "Google mobile services",
+        "Anil Sharma",
+        "Jayaprada",
+        "Bollywood",
+        "Anil Sharma",
+        "Nathan Petrelli",
+        "13 Minutes",
+        "13 Minutes",
+        "The Units",
+        "Odessa",
+    ]
+
+    def __init__(self, endpoint: str, cache: DataCache, batch_size: int = 50):
         super().__init__(endpoint, cache)
-        self.blocklist = [
-            "Alcoholic drink",
-            "Federal Insurance Contributions Act tax",
-            "Victor Perez",
-            "Kino International (company)",
-            "The Fabulous Freebirds",
-            "Taps",
-            "The Blade Runners",
-            "Divine Intervention (film)",
-            "Google mobile services",
-            "Anil Sharma",
-            "Jayaprada",
-            "Bollywood",
-            "Anil Sharma",
-            "Nathan Petrelli",
-            "13 Minutes",
-            "13 Minutes",
-            "The Units",
-            "Odessa",
-        ]
+        self.batch_size = max(1, batch_size)
+        # batches of labels can outgrow a GET request line
+        self.sparql.setMethod(POST)
 
     def run(self, items: typing.Iterable[str]) -> typing.List[typing.Tuple[str, str]]:
+        to_return = []
+        labels = self.labels(items)
+        cached = self.cache.get_many(labels)
+
+        to_fetch = [label for label in dict.fromkeys(labels) if label not in cached]
+        for start in range(0, len(to_fetch), self.batch_size):
+            batch = to_fetch[start : start + self.batch_size]
+            self.logger.info("SPARQL query for {} labels".format(len(batch)))
+            try:
+                fetched = self._fetch(batch)
+            except Exception as e:
+                # left uncached, so the next run retries them
+                self.logger.error(e)
+                continue
+
+            self.cache.set_many(
+                (label, ";".join(subjects)) for label, subjects in fetched.items()
+            )
+            cached.update(
+                (label, ";".join(subjects)) for label, subjects in fetched.items()
+            )
+
+        for label in labels:
+            subjects = cached.get(label)
+            # labels without subjects are cached empty, but not returned
+            if subjects:
+                to_return.append((label, subjects.split(";")))
+
+        return to_return
+
+    @classmethod
+    def labels(cls, items: typing.Iterable) -> typing.List[str]:
+        """Labels of the surface term URIs in ``items``, without blocked ones."""
+        labels = [
+            label.removeprefix("http://dbpedia.org/resource/").strip().replace("_", " ")
+            for _, surface_terms in items
+            for label in surface_terms
+        ]
+        return [label for label in labels if label not in cls.blocklist]
+
+    @staticmethod
+    def _literal(label: str) -> str:
+        return '"{}"@en'.format(label.replace("\\", "\\\\").replace('"', '\\"'))
+
+    def _fetch(self, labels: typing.List[str]) -> typing.Dict[str, typing.List[str]]:
         query = """\
-SELECT DISTINCT  ?subjects
+SELECT DISTINCT  ?label ?subjects
 FROM <http://dbpedia.org>
 WHERE {{
-    ?concept <http://www.w3.org/2000/01/rdf-schema#label> "{}"@en ;
+    VALUES ?label {{ {} }}
+    ?concept <http://www.w3.org/2000/01/rdf-schema#label> ?label ;
     <http://purl.org/dc/terms/subject> ?subjects .
 }}
-LIMIT  100
+ORDER BY ?label ?subjects
+LIMIT {}
+OFFSET {}
 """
-        to_return = []
-        for article_id, labels in items:
-            for label in labels:
-                label = (
-                    label.removeprefix("http://dbpedia.org/resource/")
-                    .strip()
-                    .replace("_", " ")
+        subjects = {label: [] for label in labels}
+        values = " ".join(map(self._literal, labels))
+        bindings = []
+        # page through the result, since the endpoint silently truncates it
+        # at its row cap and every label missing from it would be cached
+        # without subjects
+        while True:
+            page = self._select(query.format(values, self.PAGE_SIZE, len(bindings)))
+            bindings.extend(page)
+            if len(page) < self.PAGE_SIZE:
+                break
+        for res in bindings:
+            label = res["label"]["value"]
+            if label in subjects and len(subjects[label]) < self.SUBJECTS_PER_LABEL:
+                subjects[label].append(
+                    res["subjects"]["value"].removeprefix(
+                        "http://dbpedia.org/resource/"
+                    )
                 )
-                if label in self.blocklist:
-                    continue
-                subjects = self.cache.get(label)
-                if subjects is not None:
-                    to_return.append((label, subjects.split(";")))
-                    continue
-
-                formatted_query = query.format(label)
-                self.sparql.setQuery(formatted_query)
-
-                self.logger.info("SPARQL query for {}".format(label))
-
-                try:
-                    time.sleep(random.randint(200, 5000) / 1000)
-                    ret = self.sparql.queryAndConvert()
-                    subjects = []
-                    for res in ret["results"]["bindings"]:
-                        self.logger.info("found {}".format(res))
-                        subjects.append(
-                            res["subjects"]["value"].removeprefix(
-                                "http://dbpedia.org/resource/"
-                            )
-                        )
-                        subjects = list(set(subjects))
-                        to_return.append((label, subjects))
-                        self.cache.set(label, ";".join(subjects))
-                except Exception as e:
-                    self.logger.error(e)
-
-        return to_return
+        return subjects
@@ -1,51 +1,126 @@
 import logging
 import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from qexp.cache import DataCache
 
 
 class SpotlightExtractor(object):
+    """Annotates texts with the DBpedia resources Spotlight finds in them.
+
+    Texts are POSTed, ``concurrency`` at a time, over a pooled session. Texts
+    longer than ``CHUNK_SIZE`` characters are split into chunks overlapping
+    by ``CHUNK_OVERLAP`` characters, so surface forms on a boundary are seen
+    whole in one of them, and the annotations of all chunks are merged. Each
+    text is cached as soon as all its chunks are annotated.
+    """
+
+    CHUNK_SIZE = 10_000
+    CHUNK_OVERLAP = 200
+
     def __init__(
         self,
         url: str,
         cache: DataCache,
+        concurrency: int = 4,
     ):
         self.url = url
         self.annotate_endpoint = url + "/annotate"
         self.logger = logging.getLogger("main")
         self.cache = cache
+        self.concurrency = max(1, concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept": "application/json"})
+
+    @classmethod
+    def chunks(cls, text: str) -> typing.List[str]:
+        if len(text) <= cls.CHUNK_SIZE:
+            return [text]
+
+        chunks = []
+        start = 0
+        while start < len(text):
+            end = start + cls.CHUNK_SIZE
+            if end < len(text):
+                # cut at a space rather than inside a word
+                space = text.rfind(" ", start + cls.CHUNK_OVERLAP + 1, end)
+                end = space if space != -1 else end
+            chunks.append(text[start:end])
+            if end >= len(text):
+                break
+            start = end - cls.CHUNK_OVERLAP
+        return chunks
 
     def run(self, items: typing.Iterable) -> typing.List[typing.Tuple[str, str]]:
         to_return = []
-        for article_id, clean_text in items:
-            annotations = self.cache.get(article_id)
-            if annotations is not None:
-                to_return.append((article_id, annotations.split(";")))
-                continue
-
-            response = requests.get(
-                self.annotate_endpoint,
-                params={"text": clean_text.encode("utf-8")[:7100], "confidence": "0.6"},
-                headers={"Accept": "application/json"},
-            )
-            try:
-                response = response.json()
-            except:
-                raise SystemError(response.text)
-
-            # Spotlight returns a "Resources"-list, containing the identified
-            # annotation-objects.
-            try:
-                surface_terms = []
-                for resource in response["Resources"]:
-                    surface_terms.append(resource["@URI"])
-
-                surface_terms = list(set(surface_terms))
-                self.cache.set(article_id, ";".join(surface_terms))
-                to_return.append((article_id, surface_terms))
-            except Exception as e:
-                raise e
+        items = list(items)
+        cached = self.cache.get_many(article_id for article_id, _ in items)
+        to_fetch = {
+            article_id: clean_text
+            for article_id, clean_text in items
+            if article_id not in cached
+        }
+
+        surface_terms = {article_id: set() for article_id in to_fetch}
+        pending = {}
+        error = None
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            futures = {}
+            for article_id, clean_text in to_fetch.items():
+                chunks = self.chunks(clean_text)
+                pending[article_id] = len(chunks)
+                for chunk in chunks:
+                    futures[pool.submit(self._annotate, chunk)] = article_id
+
+            # cache every document as soon as all its chunks are annotated, so
+            # a failing chunk does not lose the rest of the window
+            for future in as_completed(futures):
+                article_id = futures[future]
+                try:
+                    surface_terms[article_id].update(future.result())
+                except Exception as e:
+                    error = error or e
+                    pending[article_id] = None
+                    continue
+                if pending[article_id] is None:
+                    continue
+                pending[article_id] -= 1
+                if pending[article_id] == 0:
+                    self.cache.set(
+                        article_id, ";".join(sorted(surface_terms[article_id]))
+                    )
+
+        if error is not None:
+            raise error
+
+        for article_id, _ in items:
+            if article_id in surface_terms:
+                to_return.append((article_id, sorted(surface_terms[article_id])))
+            elif cached[article_id]:
+                to_return.append((article_id, cached[article_id].split(";")))
+            else:
+                to_return.append((article_id, []))
 
         return to_return
+
+    def _annotate(self, text: str) -> typing.List[str]:
+        response = self.session.post(
+            self.annotate_endpoint,
+            data={"text": text, "confidence": "0.6"},
+            timeout=300,
+        )
+        try:
+            response = response.json()
+        except:
+            raise SystemError(response.text)
+
+        # Spotlight returns a "Resources"-list, containing the identified
+        # annotation-objects; it is absent if nothing was found
+        return [resource["@URI"] for resource in response.get("Resources", [])]
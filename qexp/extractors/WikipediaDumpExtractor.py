@@ -0,0 +1,188 @@
+import bz2
+import itertools as it
+import logging
+import os
+import typing
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from qexp import types
+from qexp.cache import DataCache
+from qexp.extractors.WikipediaExtractor import WikipediaRevisionExtractor
+
+
+class DumpIndexError(Exception):
+    pass
+
+
+# compressed bytes read from the dump at a time while inflating a stream
+READ_SIZE = 256 * 1024
+
+
+def _read_stream(dump_path: str, offset: int) -> bytes:
+    """Inflate the single bz2 stream starting at byte ``offset``."""
+    decompressor = bz2.BZ2Decompressor()
+    chunks = []
+    with open(dump_path, "rb") as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            chunks.append(decompressor.decompress(data))
+    return b"".join(chunks)
+
+
+def _read_pages(
+    dump_path: str, offset: int, pageids: typing.Collection[str]
+) -> typing.List[types.PipelineResult]:
+    """Wikitext of the ``pageids`` stored in the stream at ``offset``."""
+    # a stream holds a run of <page> elements without their <mediawiki> root
+    # (or namespace), so parse them under a synthetic one
+    root = ET.fromstring(b"<pages>" + _read_stream(dump_path, offset) + b"</pages>")
+    found = []
+    for page in root.iter("page"):
+        pageid = (page.findtext("id") or "").strip()
+        if pageid in pageids:
+            found.append((pageid, page.findtext("revision/text") or ""))
+    return found
+
+
+class WikipediaDumpExtractor(object):
+    """Drop-in replacement for :py:class:`WikipediaRevisionExtractor` that
+    reads the current revisions from a local
+    ``pages-articles-multistream.xml.bz2`` dump instead of the API.
+
+    The dump is a concatenation of bz2 streams of about 100 pages each, and
+    its index maps every page to the byte offset of its stream. The index is
+    loaded once into a SQLite store in ``index_dir``; afterwards a request
+    only inflates the streams holding the requested pages, ``workers`` of
+    them in parallel.
+    """
+
+    # index lines inserted per transaction while loading the index
+    INDEX_CHUNK_SIZE = 100_000
+    # key in the index store recording which index file it was loaded from
+    SOURCE_KEY = "__source__"
+
+    def __init__(
+        self,
+        dump_path: str,
+        cache: DataCache,
+        index_dir: str,
+        index_path: str | None = None,
+        workers: int = 4,
+    ):
+        self.dump_path = dump_path
+        self.index_path = index_path or self.default_index_path(dump_path)
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.logger = logging.getLogger("main")
+
+        for path in (self.dump_path, self.index_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError("Dump file {} does not exist".format(path))
+
+        os.makedirs(index_dir, exist_ok=True)
+        self.index = DataCache(
+            os.path.join(index_dir, os.path.basename(self.index_path)),
+            backend="sqlite",
+        )
+        self._load_index()
+
+    @staticmethod
+    def default_index_path(dump_path: str) -> str:
+        # enwiki-<date>-pages-articles-multistream.xml.bz2 ships with
+        # enwiki-<date>-pages-articles-multistream-index.txt.bz2
+        return dump_path.replace(".xml.bz2", "-index.txt.bz2")
+
+    def _source(self) -> str:
+        stat = os.stat(self.index_path)
+        return "{}:{}:{}".format(
+            os.path.abspath(self.index_path), stat.st_size, int(stat.st_mtime)
+        )
+
+    def _load_index(self):
+        source = self._source()
+        if self.index.get(self.SOURCE_KEY) == source:
+            return
+
+        self.logger.info("Loading dump index {}".format(self.index_path))
+        opener = bz2.open if self.index_path.endswith(".bz2") else open
+        entries = 0
+        with opener(self.index_path, "rt", encoding="utf-8") as f:
+            # offset:pageid:title, where the title may itself contain colons
+            pairs = (line.split(":", 2)[1::-1] for line in f if line.strip())
+            while chunk := list(it.islice(pairs, self.INDEX_CHUNK_SIZE)):
+                if any(len(pair) != 2 for pair in chunk):
+                    raise DumpIndexError(
+                        "Malformed dump index {}".format(self.index_path)
+                    )
+                self.index.set_many(chunk)
+                entries += len(chunk)
+        self.index.set(self.SOURCE_KEY, source)
+        self.logger.info("Loaded {} dump index entries".format(entries))
+
+    def run(
+        self, article_ids: typing.Iterable[str]
+    ) -> typing.List[typing.Tuple[str, str]]:
+        to_fetch = []
+        to_return: typing.List[typing.Tuple[str, str]] = []
+        article_ids = [article_id for article_id in article_ids if len(article_id)]
+        cached = self.cache.get_many(article_ids)
+        for article_id in article_ids:
+            revision = cached.get(article_id)
+            if revision is None:
+                to_fetch.append(article_id)
+                continue
+            else:
+                to_return.append((article_id, revision))
+
+        offsets = self.index.get_many(to_fetch)
+        streams = defaultdict(set)
+        for article_id in dict.fromkeys(to_fetch):
+            if article_id in offsets:
+                streams[int(offsets[article_id])].add(article_id)
+            else:
+                self.logger.warning("Page {} is not in the dump".format(article_id))
+        if not streams:
+            return to_return
+
+        self.logger.info(
+            "Reading {} pages from {} dump streams".format(
+                sum(len(pageids) for pageids in streams.values()), len(streams)
+            )
+        )
+        with ProcessPoolExecutor(self.workers) as pool:
+            # map keeps the streams in order, so results stay deterministic
+            for fetched in pool.map(
+                _read_pages,
+                it.repeat(self.dump_path),
+                sorted(streams),
+                [streams[offset] for offset in sorted(streams)],
+            ):
+                self.cache.set_many(fetched)
+                to_return.extend(fetched)
+
+        return to_return
+
+
+def revision_extractor(config) -> WikipediaDumpExtractor | WikipediaRevisionExtractor:
+    """The revision extractor configured in ``[wikipedia]``: reading from the
+    local dump if ``dump_path`` is set, from the API otherwise."""
+    cache = DataCache.from_config(config, "extracts_path")
+    if config.get("wikipedia", "dump_path"):
+        return WikipediaDumpExtractor(
+            dump_path=config.get("wikipedia", "dump_path"),
+            cache=cache,
+            index_dir=config.get("data", "dump_index_path"),
+            index_path=config.get("wikipedia", "dump_index_path"),
+            workers=config.get("wikipedia", "dump_workers") or 4,
+        )
+    return WikipediaRevisionExtractor(
+        url=config.get("wikipedia", "endpoint"),
+        cache=cache,
+        batch_size=config.get("wikipedia", "batch_size") or 50,
+        concurrency=config.get("wikipedia", "concurrency") or 4,
+    )
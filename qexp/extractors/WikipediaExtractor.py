@@ -1,15 +1,34 @@
 import logging
+import random
+import threading
+import time
 import typing
-from itertools import islice, repeat
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 from urllib.parse import unquote
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from qexp import types
 from qexp.cache import DataCache
 
 
+class WikipediaAPIError(SystemError):
+    pass
+
+
 class BaseWikipediaExtractor(object):
+    # connections kept open to the API, shared by all threads using the
+    # extractor
+    POOL_SIZE = 16
+    MAX_RETRIES = 6
+    # seconds; doubled on every retry
+    BACKOFF = 1.0
+    # ask the API to refuse requests while replication lags by more than this
+    # many seconds, see https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
+    MAXLAG = 5
+
     def __init__(self, url: str, cache: DataCache):
         self.results = []
         self.url = url
@@ -17,6 +36,10 @@ class BaseWikipediaExtractor(object):
         self.logger = logging.getLogger("main")
         self.cache = cache
 
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
         self.session.headers.update(
             {
                 "accept": "application/json",
@@ -32,16 +55,54 @@ class BaseWikipediaExtractor(object):
         it = iter(xs)
         return iter(lambda: tuple(islice(it, size)), ())
 
+    def _get(self, params: typing.Dict[str, str]) -> typing.Dict:
+        """Issue one API request, retrying with exponential backoff on
+        connection errors, 429/5xx responses and maxlag errors."""
+        for attempt in range(self.MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                # per-request params are merged with the session's defaults
+                # and leave them untouched, so one extractor can serve several
+                # threads
+                response = self.session.get(
+                    self.url, params={**params, "maxlag": self.MAXLAG}, timeout=60
+                )
+                retry_after = response.headers.get("Retry-After")
+                if response.status_code == 429 or response.status_code >= 500:
+                    reason = "HTTP {}".format(response.status_code)
+                else:
+                    res = response.json()
+                    if res.get("error", {}).get("code") != "maxlag":
+                        return res
+                    reason = "maxlag: {}".format(res["error"].get("info"))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                reason = repr(e)
+
+            if attempt == self.MAX_RETRIES:
+                break
+            delay = self.BACKOFF * 2**attempt
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            delay *= random.uniform(1, 1.5)
+            self.logger.warning(
+                "{}, retrying in {:.1f}s ({}/{})".format(
+                    reason, delay, attempt + 1, self.MAX_RETRIES
+                )
+            )
+            time.sleep(delay)
+
+        raise WikipediaAPIError(
+            "Giving up after {} retries: {}".format(self.MAX_RETRIES, reason)
+        )
+
     def _query(self, query_items: typing.Dict[str, str], nocontinue=False):
         self.logger.info("Querying {}".format(",".join(query_items.values())))
         last_continue: typing.Dict[str, str] = {}
         while True:
-            self.session.params.update(last_continue)  # pyright: ignore
-            self.session.params.update(query_items)  # pyright: ignore
-            res = self.session.get(self.url).json()
+            res = self._get({**last_continue, **query_items})
 
             if "error" in res:
-                raise SystemError(res["error"])
+                raise WikipediaAPIError(res["error"])
             if "warnings" in res:
                 self.logger.warning(res["warnings"])
             if "query" in res:
@@ -54,8 +115,18 @@ class BaseWikipediaExtractor(object):
 
 
 class WikipediaCategorySampler(BaseWikipediaExtractor):
-    def __init__(self, url: str, cache: DataCache):
+    """Samples the first page of members of each category.
+
+    Categories are fetched ``concurrency`` at a time. Requests for the same
+    category, within a call or from calls in other threads, are collapsed
+    into a single one.
+    """
+
+    def __init__(self, url: str, cache: DataCache, concurrency: int = 4):
         super().__init__(url, cache)
+        self.concurrency = max(1, concurrency)
+        self._inflight: typing.Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
         self.session.params = {
             "action": "query",
             "generator": "categorymembers",
@@ -76,26 +147,55 @@ class WikipediaCategorySampler(BaseWikipediaExtractor):
             for category in categories
         ]
 
+        cached = self.cache.get_many(category for _, category in things)
         for concept, category in things:
-            sub_pages = self.cache.get(category)
+            sub_pages = cached.get(category)
             if sub_pages is None:
                 to_fetch.append(category)
                 continue
             else:
                 to_return.append((category, sub_pages.split(";")))
 
-        self.logger.info(
-            "Extracting cat-members for {} categories".format(len(to_fetch))
-        )
+        unique = list(dict.fromkeys(to_fetch))
+        self.logger.info("Extracting cat-members for {} categories".format(len(unique)))
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            cached.update(zip(unique, pool.map(self._sample, unique)))
+
+        # one entry per requested category, in request order, just as for
+        # cache hits
         for category in to_fetch:
-            # check cache again, it may have been updated already
-            sub_pages = self.cache.get(category)
+            sub_pages = cached[category]
             if sub_pages is not None:
-                to_return.extend(zip(repeat(category), sub_pages.split(";")))
-                continue
+                to_return.append((category, sub_pages.split(";")))
 
-            # nocontinue=True, because we don't need the entire cat-tree, the
-            # first page is sufficient
+        return to_return
+
+    def _sample(self, category: str) -> str | None:
+        """Cached member sample of ``category``, or None if it could not be
+        fetched. Waits for a request another thread has in flight instead of
+        issuing a second one."""
+        with self._inflight_lock:
+            future = self._inflight.get(category)
+            owner = future is None
+            if owner:
+                future = self._inflight[category] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(self._fetch(category))
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[category]
+        return future.result()
+
+    def _fetch(self, category: str) -> str | None:
+        # nocontinue=True, because we don't need the entire cat-tree, the
+        # first page is sufficient
+        try:
             for res in self._query(
                 {"gcmtitle": "{}".format(category)}, nocontinue=True
             ):
@@ -107,19 +207,30 @@ class WikipediaCategorySampler(BaseWikipediaExtractor):
                     if not title.startswith(("File:", "Template:", "Category:")):
                         pages.append(pageid)
 
-                self.cache.set(category, ";".join(pages))
-                to_return.extend(zip(repeat(category), pages))
-                break
-            else:
-                self.cache.set(category, "")
-                to_return.extend([(category, "")])
-
-        return to_return
+                return self.cache.set(category, ";".join(pages))
+            return self.cache.set(category, "")
+        except WikipediaAPIError as e:
+            # left uncached, so the next run retries it
+            self.logger.error("Skipping category {}: {}".format(category, e))
+            return None
 
 
 class WikipediaRevisionExtractor(BaseWikipediaExtractor):
-    def __init__(self, url: str, cache: DataCache):
+    # the API accepts at most 50 pageids per request (500 with apihighlimits)
+    MAX_BATCH_SIZE = 50
+
+    def __init__(
+        self, url: str, cache: DataCache, batch_size: int = 50, concurrency: int = 4
+    ):
         super().__init__(url, cache)
+        if batch_size > self.MAX_BATCH_SIZE:
+            self.logger.warning(
+                "batch_size {} exceeds the API limit, using {}".format(
+                    batch_size, self.MAX_BATCH_SIZE
+                )
+            )
+        self.batch_size = max(1, min(batch_size, self.MAX_BATCH_SIZE))
+        self.concurrency = max(1, concurrency)
         self.session.params = {
             "action": "query",
             "prop": "revisions",
@@ -134,36 +245,75 @@ class WikipediaRevisionExtractor(BaseWikipediaExtractor):
     ) -> typing.List[typing.Tuple[str, str]]:
         to_fetch = []
         to_return: typing.List[typing.Tuple[str, str]] = []
+        article_ids = [article_id for article_id in article_ids if len(article_id)]
+        cached = self.cache.get_many(article_ids)
         for article_id in article_ids:
-            if len(article_id) == 0:
-                continue
-            revision = self.cache.get(article_id)
+            revision = cached.get(article_id)
             if revision is None:
                 to_fetch.append(article_id)
                 continue
             else:
                 to_return.append((article_id, revision))
 
-        for article_id in self._chunk(to_fetch, 5):
-            # article_id = list(filter(lambda x: len(x)>1, article_id))
-            self.logger.info("Querying {} revisions".format(len(article_id)))
-            for res in self._query({"pageids": "|".join(article_id)}):
+        batches = self._chunk(dict.fromkeys(to_fetch), self.batch_size)
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            # map keeps the batches in order, so results stay deterministic
+            for fetched in pool.map(self._fetch, batches):
+                self.cache.set_many(fetched)
+                to_return.extend(fetched)
+
+        return to_return
+
+    def _fetch(
+        self, article_ids: typing.Tuple[str, ...]
+    ) -> typing.List[types.PipelineResult]:
+        self.logger.info("Querying {} revisions".format(len(article_ids)))
+        fetched = {}
+        try:
+            for res in self._query({"pageids": "|".join(article_ids)}):
                 for page in res["pages"]:
                     if "missing" in page and page["missing"]:
                         continue
+                    # content for many pages is spread over continued
+                    # responses, pages without revisions are filled in by a
+                    # later one
+                    if "revisions" not in page:
+                        continue
                     pageid = str(page["pageid"]).strip()
-                    revision = page["revisions"][0]["slots"]["main"]["content"]
-                    self.cache.set(
-                        pageid,
-                        revision,
-                    )
+                    if pageid not in fetched:
+                        revision = page["revisions"][0]["slots"]["main"]["content"]
+                        fetched[pageid] = revision
+        except WikipediaAPIError as e:
+            # keep what arrived, the rest stays uncached for the next run
+            self.logger.error(
+                "Failed fetching {} revisions: {}".format(
+                    len(article_ids) - len(fetched), e
+                )
+            )
 
-                    to_return.append((pageid, revision))
-
-        return to_return
+        return list(fetched.items())
 
 
 class PageLinkExtractor(BaseWikipediaExtractor):
+    """Extracts the IDs of the articles linked from each page title.
+
+    Titles are sent ``TITLES_PER_REQUEST`` at a time. ``prop=links`` tells
+    which title links where, and ``generator=links`` over the same titles
+    resolves the linked titles to page IDs.
+
+    With ``no_continue`` only the first ``LINKS_PER_TITLE`` links of each
+    title are kept. Their pages come in order of the linking page, so a
+    batched query would page through every link of the titles before the
+    last one; instead each title costs a single ``generator=links`` request
+    limited to those links.
+    """
+
+    parallelism = types.IO_BOUND
+
+    # the API accepts at most 50 titles per request (500 with apihighlimits)
+    TITLES_PER_REQUEST = 50
+    LINKS_PER_TITLE = 100
+
     def __init__(
         self,
         url: str,
@@ -173,13 +323,9 @@ class PageLinkExtractor(BaseWikipediaExtractor):
     ):
         super().__init__(url, cache)
         self.no_continue = no_continue
-        self.exclude_list = exclude_list
+        self.exclude_list = frozenset(str(pageid) for pageid in exclude_list)
         self.session.params = {
             "action": "query",
-            "generator": "links",
-            "gplnamespace": "0",
-            "gpllimit": "100",
-            "prop": "info",
             "format": "json",
             "formatversion": "2",
         }
@@ -189,9 +335,11 @@ class PageLinkExtractor(BaseWikipediaExtractor):
     ) -> typing.List[types.PipelineListResult]:
         to_return = []
         to_fetch = []
+        page_titles = list(page_titles)
+        cached = self.cache.get_many(page_titles)
         for page_title in page_titles:
 
-            links = self.cache.get(page_title)
+            links = cached.get(page_title)
             if links is None:
                 to_fetch.append(page_title)
                 continue
@@ -199,25 +347,102 @@ class PageLinkExtractor(BaseWikipediaExtractor):
                 links = links.split(",")
                 to_return.append((page_title, links))
 
-        for page_title in to_fetch:
-            self.logger.info(f"Querying links for {page_title}")
+        for batch in self._chunk(dict.fromkeys(to_fetch), self.TITLES_PER_REQUEST):
+            self.logger.info("Querying links for {} titles".format(len(batch)))
 
-            for res in self._query(
-                {"titles": page_title.replace(" ", "_")}, nocontinue=self.no_continue
-            ):
-                link_ids = []
-                for page in res["pages"]:
-                    if (
-                        "missing" in page and page["missing"] is True
-                    ) or not "pageid" in page:
-                        continue
-                    if str(page["pageid"]) in self.exclude_list:
-                        continue
+            try:
+                fetched = self._fetch(batch)
+            except WikipediaAPIError as e:
+                self.logger.error(
+                    "Skipping links of {} titles: {}".format(len(batch), e)
+                )
+                continue
+
+            self.cache.set_many(
+                (page_title, ",".join(link_ids))
+                for page_title, link_ids in fetched.items()
+            )
+            to_return.extend(fetched.items())
 
-                    link_ids.append(str(page["pageid"]))
+        return to_return
 
-                self.cache.set(page_title, ",".join(link_ids))
+    def _fetch(
+        self, page_titles: typing.Tuple[types.PageTitle, ...]
+    ) -> typing.Dict[types.PageTitle, typing.List[types.PageID]]:
+        if self.no_continue:
+            return self._fetch_first(page_titles)
 
-                to_return.append((page_title, link_ids))
+        sent = {page_title: page_title.replace(" ", "_") for page_title in page_titles}
+        titles = "|".join(sent.values())
 
-        return to_return
+        normalized = {}
+        links = {}
+        for res in self._query(
+            {
+                "titles": titles,
+                "prop": "links",
+                "plnamespace": "0",
+                "pllimit": "max",
+            }
+        ):
+            normalized.update({n["from"]: n["to"] for n in res.get("normalized", [])})
+            for page in res["pages"]:
+                # missing titles have no links and are left out, as before
+                if "missing" in page and page["missing"] is True:
+                    continue
+                links.setdefault(page["title"], []).extend(
+                    link["title"] for link in page.get("links", [])
+                )
+
+        pageids = {}
+        for res in self._query(
+            {
+                "titles": titles,
+                "generator": "links",
+                "gplnamespace": "0",
+                "gpllimit": "max",
+                "prop": "info",
+            }
+        ):
+            for page in res["pages"]:
+                if "pageid" in page:
+                    pageids[page["title"]] = str(page["pageid"])
+
+        fetched = {}
+        for page_title, title in sent.items():
+            title = normalized.get(title, title)
+            if title not in links:
+                continue
+            linked = sorted(links[title])
+            fetched[page_title] = [
+                pageids[link]
+                for link in linked
+                if link in pageids and pageids[link] not in self.exclude_list
+            ]
+        return fetched
+
+    def _fetch_first(
+        self, page_titles: typing.Tuple[types.PageTitle, ...]
+    ) -> typing.Dict[types.PageTitle, typing.List[types.PageID]]:
+        fetched = {}
+        for page_title in page_titles:
+            link_ids = []
+            for res in self._query(
+                {
+                    "titles": page_title.replace(" ", "_"),
+                    "generator": "links",
+                    "gplnamespace": "0",
+                    "gpllimit": str(self.LINKS_PER_TITLE),
+                    "prop": "info",
+                },
+                nocontinue=True,
+            ):
+                for page in res["pages"]:
+                    # red links have no page ID
+                    if (
+                        "pageid" in page
+                        and str(page["pageid"]) not in self.exclude_list
+                    ):
+                        link_ids.append(str(page["pageid"]))
+            fetched[page_title] = link_ids
+        return fetched
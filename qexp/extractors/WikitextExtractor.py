@@ -1,41 +1,272 @@
+import html
 import logging
 import re
+import time
 import typing
+from concurrent.futures import ProcessPoolExecutor
 
 import mwparserfromhell
+from mwparserfromhell.definitions import INVISIBLE_TAGS
 
+from qexp import types
 from qexp.cache import DataCache
+from qexp.util.parallel import chunked
+
+ENGINES = ("mwparser", "fast")
+
+# constructs of the fast engine, see WikitextExtractor.strip_fast
+COMMENT = re.compile(r"<!--.*?(?:-->|$)", re.S)
+# tags dropped with their contents: references, HTML tables and the tags
+# mwparserfromhell does not render
+DROPPED_TAG = re.compile(
+    r"<({})\b[^>]*?(?:/>|>.*?</\1\s*>)".format(
+        "|".join(["ref", "table", *INVISIBLE_TAGS])
+    ),
+    re.S | re.I,
+)
+NESTED = re.compile(r"\{\{\{|\}\}\}|\{\{|\}\}|\{\||\|\}|\[\[|\]\]")
+CLOSING = {"{{{": "}}}", "{{": "}}", "{|": "|}", "[[": "]]"}
+EXTERNAL_LINK = re.compile(r"\[(?:https?:|ftp:)?//[^\s\]]*\s*([^\]]*)\]")
+EMPHASIS = re.compile(r"'{2,}")
+HEADING = re.compile(r"^(=+)\s*(.*?)\s*\1\s*$", re.M)
+LINE_MARKUP = re.compile(r"^(?:[*#:;]+|-{4,})", re.M)
+TAG = re.compile(r"</?[A-Za-z][^>]*>")
+BLANK_LINES = re.compile(r"\n\s*\n\s*")
+# category links in raw wikitext, for revisions cleaned before the category
+# index existed
+CATEGORY_LINK = re.compile(r"\[\[\s*category\s*:([^\]|]*)", re.I)
 
 
 class WikitextExtractor(object):
+    """Strips the markup off revisions.
+
+    ``engine`` selects how: ``"mwparser"`` (:py:meth:`strip`) parses the
+    full wikicode, ``"fast"`` (:py:meth:`strip_fast`) drops the same
+    constructs in a single scan over the text, at a fraction of the cost.
+
+    With ``workers`` > 1 the cache misses of each call are cleaned in chunks
+    on a pool of that many processes, kept open across calls until
+    :py:meth:`close`; cache lookups and writes stay in the calling process
+    and happen in input order either way.
+
+    With a ``category_index``, the category links dropped while cleaning are
+    stored there per page ID, newline-separated, for ``main.py categories``.
+    """
+
     # Kudos to earwigbot, whence this code originated
     # https://github.com/earwig/earwigbot/blob/develop/earwigbot/wiki/copyvios/parsers.py
 
     TEMPLATE_MERGE_THRESHOLD = 25
 
+    parallelism = types.CPU_BOUND
+
     def __init__(
         self,
         cache: DataCache,
+        workers: int = 1,
+        engine: str = "mwparser",
+        category_index: DataCache | None = None,
     ):
+        if engine not in ENGINES:
+            raise ValueError(
+                "Unknown stripping engine {!r}, expected one of {}".format(
+                    engine, ", ".join(ENGINES)
+                )
+            )
         self.filename = ""
         self.logger = logging.getLogger("main")
         self.cache = cache
+        self.engine = engine
+        self.category_index = category_index
+        self.workers = max(1, workers)
+        if self.workers > 1:
+            # the extractor runs its own pool over the cache misses only, so
+            # the Pipeline must not fan it out as well
+            self.parallelism = None
+        self._pool = None
+
+    def __getstate__(self):
+        # the pool stays with the process that opened it
+        return {k: v for k, v in self.__dict__.items() if k != "_pool"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
 
     def run(self, items) -> typing.List[typing.Tuple[str, str]]:
-        cleaned_revisions = []
+        items = list(items)
+        cached = self.cache.get_many(article_id for article_id, _ in items)
+        to_clean = {
+            article_id: revision_with_markup
+            for article_id, revision_with_markup in items
+            if article_id not in cached
+        }
+
+        categories = {}
+        if to_clean:
+            start = time.perf_counter()
+            fresh = []
+            for article_id, (clean_text, links) in zip(
+                to_clean, self._strip_all(list(to_clean.values()))
+            ):
+                fresh.append((article_id, clean_text))
+                categories[article_id] = links
+            elapsed = time.perf_counter() - start
+            self.logger.info(
+                "Cleaned {} revisions ({:.1f} MB) in {:.2f}s, {:.1f} revisions/s"
+                " on {} worker(s) with the {} engine".format(
+                    len(fresh),
+                    sum(map(len, to_clean.values())) / 2**20,
+                    elapsed,
+                    len(fresh) / elapsed if elapsed else 0.0,
+                    self.workers,
+                    self.engine,
+                )
+            )
+            self.cache.set_many(fresh)
+            cached.update(fresh)
+
+        if self.category_index is not None:
+            self._index_categories(items, categories)
+
+        return [(article_id, cached[article_id]) for article_id, _ in items]
+
+    def _index_categories(
+        self, items: typing.List[types.PipelineResult], categories: typing.Dict
+    ):
+        indexed = self.category_index.get_many(article_id for article_id, _ in items)
         for article_id, revision_with_markup in items:
-            # Return early if the cache already contains the cleaned extract
-            clean_text = self.cache.get(article_id)
-            if clean_text is not None:
-                cleaned_revisions.append((article_id, clean_text))
+            if article_id not in indexed and article_id not in categories:
+                # cleaned before the index existed
+                categories[article_id] = [
+                    category.strip()
+                    for category in CATEGORY_LINK.findall(revision_with_markup)
+                ]
+        self.category_index.set_many(
+            (article_id, "\n".join(dict.fromkeys(filter(None, links))))
+            for article_id, links in categories.items()
+            if article_id not in indexed
+        )
+
+    def _strip_all(
+        self, texts: typing.List[str]
+    ) -> typing.List[typing.Tuple[str, typing.List[str]]]:
+        if self.workers <= 1 or len(texts) < 2:
+            return self._strip_chunk(texts)
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+        # map keeps the chunks in order, so results line up with texts
+        return [
+            clean
+            for chunk in self._pool.map(self._strip_chunk, chunked(texts, self.workers))
+            for clean in chunk
+        ]
+
+    def _strip_chunk(
+        self, texts: typing.List[str]
+    ) -> typing.List[typing.Tuple[str, typing.List[str]]]:
+        """Clean ``texts``, along with the categories each links to."""
+        strip = self.strip_fast if self.engine == "fast" else self.strip
+        stripped = []
+        for text in texts:
+            categories = []
+            stripped.append((strip(text, categories), categories))
+        return stripped
+
+    @staticmethod
+    def strip_fast(text: str, categories: list | None = None) -> str:
+        """Approximation of :py:meth:`strip` without building a syntax tree.
+
+        Comments, references, tables and invisible tags are cut out with
+        regular expressions; templates, wiki tables and links, which nest,
+        are resolved in one scan over their delimiters. Links keep their
+        label, unless they point to a file or category. What remains loses
+        its external link targets, emphasis, heading and list markup and
+        HTML tags, and has its entities decoded.
+
+        The names of linked categories are appended to ``categories``.
+        """
+        text = COMMENT.sub("", text)
+        text = DROPPED_TAG.sub("", text)
+
+        # each open construct collects the text it encloses
+        stack: typing.List[typing.Tuple[str, typing.List[str]]] = []
+        out: typing.List[str] = []
+        pos = 0
+        while match := NESTED.search(text, pos):
+            token = match.group()
+            parts = stack[-1][1] if stack else out
+            parts.append(text[pos : match.start()])
+            pos = match.end()
+            top = stack[-1][0] if stack else None
+
+            if token == "}}}" and top != "{{{":
+                # the end of a template followed by a brace
+                token = "}}"
+                pos -= 1
+            elif token == "|}" and top != "{|":
+                # a pipe followed by a closing brace
+                parts.append("|")
+                pos -= 1
+                continue
+            elif token == "{|" and match.start() and text[match.start() - 1] != "\n":
+                # tables only start at the beginning of a line
+                parts.append("{")
+                pos -= 1
+                continue
+
+            if token in CLOSING:
+                stack.append((token, []))
+            elif top is not None and CLOSING[top] == token:
+                _, contents = stack.pop()
+                parent = stack[-1][1] if stack else out
+                if top == "[[":
+                    parent.append(
+                        WikitextExtractor._link_label("".join(contents), categories)
+                    )
+                elif top == "{{{":
+                    # template arguments render as their default
+                    parent.append("".join(contents).partition("|")[2])
+                # templates and tables are dropped
             else:
-                clean_text = self.strip(revision_with_markup)
-                self.cache.set(article_id, clean_text)
-                cleaned_revisions.append((article_id, clean_text))
+                # stray closing delimiter, keep it as text like the parser
+                parts.append(token)
+        (stack[-1][1] if stack else out).append(text[pos:])
+        # unclosed constructs are plain text to the parser as well
+        while stack:
+            opening, contents = stack.pop()
+            (stack[-1][1] if stack else out).extend([opening, *contents])
 
-        return cleaned_revisions
+        text = "".join(out)
+        text = EXTERNAL_LINK.sub(r"\1", text)
+        text = EMPHASIS.sub("", text)
+        text = HEADING.sub(r" \2 ", text)
+        text = LINE_MARKUP.sub("", text)
+        text = TAG.sub("", text)
+        text = html.unescape(text)
+        return BLANK_LINES.sub("\n", text).strip()
 
-    def strip(self, text: str):
+    @staticmethod
+    def _link_label(contents: str, categories: list | None = None) -> str:
+        title, _, label = contents.partition("|")
+        prefix, _, name = title.strip().partition(":")
+        if prefix.strip().lower() in ("file", "image"):
+            return ""
+        if prefix.strip().lower() == "category":
+            if categories is not None:
+                categories.append(name.strip())
+            return ""
+        return label or title
+
+    def strip(self, text: str, categories: list | None = None):
         """Clean the page's raw text by removing templates and formatting.
         Return the page's text with all HTML and wikicode formatting removed,
         including templates, tables, and references. It retains punctuation
@@ -43,6 +274,7 @@ class WikitextExtractor(object):
         quotes), original capitalization, and so forth. HTML entities are
         replaced by their unicode equivalents.
         The actual stripping is handled by :py:mod:`mwparserfromhell`.
+        The names of linked categories are appended to ``categories``.
         """
 
         def remove(code, node):
@@ -61,7 +293,10 @@ class WikitextExtractor(object):
         # Preemtively strip some links mwparser doesn't know about:
         bad_prefixes = ("file:", "image:", "category:")
         for link in wikicode.filter_wikilinks():
-            if link.title.strip().lower().startswith(bad_prefixes):
+            title = link.title.strip()
+            if title.lower().startswith(bad_prefixes):
+                if categories is not None and title.lower().startswith("category:"):
+                    categories.append(title.partition(":")[2].strip())
                 remove(wikicode, link)
 
         for tpl in wikicode.filter_templates():
@@ -96,3 +331,14 @@ class WikitextExtractor(object):
                 code.replace(template, " " + subst + " ")
             else:
                 code.remove(template)
+
+
+def wikitext_extractor(config) -> WikitextExtractor:
+    """The cleaning step configured in ``[wikitext]``, recording categories
+    in the index at ``[data] category_index_path``."""
+    return WikitextExtractor(
+        cache=DataCache.from_config(config, "clean_path"),
+        workers=config.get("wikitext", "workers") or 1,
+        engine=config.get("wikitext", "engine") or "mwparser",
+        category_index=DataCache.from_config(config, "category_index_path"),
+    )
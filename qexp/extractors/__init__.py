@@ -1,4 +1,12 @@
+from .DBpediaExtractor import (
+    DBpediaPageIdExtractor,
+    DBpediaSubjectExtractor,
+    page_id_extractor,
+    subject_extractor,
+)
+from .LexiconExtractor import LexiconExtractor, surface_term_extractor
 from .SparqlExtractor import SubjectExtractor
 from .SpotlightExtractor import SpotlightExtractor
+from .WikipediaDumpExtractor import WikipediaDumpExtractor, revision_extractor
 from .WikipediaExtractor import WikipediaCategorySampler, WikipediaRevisionExtractor
-from .WikitextExtractor import WikitextExtractor
+from .WikitextExtractor import WikitextExtractor, wikitext_extractor
@@ -0,0 +1,283 @@
+import array
+import bisect
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import typing
+
+import igraph
+import numpy as np
+
+import qexp.util.types as mytypes
+
+
+class GraphFormatError(Exception):
+    pass
+
+
+class StringTable(object):
+    """Sorted, front-coded table of vertex names.
+
+    Each name is stored as the length of the prefix it shares with its
+    predecessor plus the remaining UTF-8 bytes, so the long common URI
+    prefixes are stored about once per ``BLOCK`` names. Every ``BLOCK``-th
+    name is stored whole, which bounds the decoding work of a lookup.
+
+    The ID of a name is its position in sorted order.
+    """
+
+    BLOCK = 16
+    ARRAYS = ("shared", "offsets", "suffixes")
+
+    def __init__(self, shared: np.ndarray, offsets: np.ndarray, suffixes: np.ndarray):
+        self.shared = shared
+        self.offsets = offsets
+        self.suffixes = suffixes
+
+    @classmethod
+    def build(cls, names: typing.Sequence[str]) -> "StringTable":
+        """Table of ``names``, which must be sorted and unique."""
+        shared = array.array("I")
+        offsets = array.array("q", [0])
+        suffixes = bytearray()
+        previous = b""
+        for i, name in enumerate(names):
+            encoded = name.encode("utf-8")
+            common = 0
+            if i % cls.BLOCK:
+                limit = min(len(previous), len(encoded))
+                while common < limit and previous[common] == encoded[common]:
+                    common += 1
+            shared.append(common)
+            suffixes += encoded[common:]
+            offsets.append(len(suffixes))
+            previous = encoded
+
+        return cls(
+            np.frombuffer(shared, dtype=np.uint32),
+            np.frombuffer(offsets, dtype=np.int64),
+            np.frombuffer(bytes(suffixes), dtype=np.uint8),
+        )
+
+    def __len__(self):
+        return len(self.shared)
+
+    def _suffix(self, i: int) -> bytes:
+        return self.suffixes[self.offsets[i] : self.offsets[i + 1]].tobytes()
+
+    def _decode_block(self, block: int) -> typing.Iterator[bytes]:
+        name = b""
+        for i in range(block * self.BLOCK, min(len(self), (block + 1) * self.BLOCK)):
+            name = name[: self.shared[i]] + self._suffix(i)
+            yield name
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        block, position = divmod(i, self.BLOCK)
+        for j, name in enumerate(self._decode_block(block)):
+            if j == position:
+                return name.decode("utf-8")
+
+    def index(self, name: str) -> int:
+        """ID of ``name``, raises a :py:class:`KeyError` if it is absent."""
+        encoded = name.encode("utf-8")
+        # the first name of each block is stored whole
+        blocks = range(0, len(self), self.BLOCK)
+        block = bisect.bisect_right(blocks, encoded, key=self._suffix) - 1
+        if block >= 0:
+            for j, candidate in enumerate(self._decode_block(block)):
+                if candidate == encoded:
+                    return block * self.BLOCK + j
+        raise KeyError(name)
+
+    def names(self) -> typing.List[str]:
+        """All names, in ID order."""
+        return [
+            name.decode("utf-8")
+            for block in range(-(-len(self) // self.BLOCK))
+            for name in self._decode_block(block)
+        ]
+
+
+class CSRGraph(object):
+    """Undirected, simple graph in compressed sparse row form.
+
+    The neighbours of vertex ``v`` are ``indices[indptr[v]:indptr[v + 1]]``,
+    sorted, with every edge stored in both directions. Vertex names live in
+    a :py:class:`StringTable`.
+
+    :py:meth:`save` writes each array as an ``.npy`` file into a directory,
+    which :py:meth:`load` memory-maps read-only: loading takes milliseconds
+    regardless of the graph size, and processes loading the same graph
+    share its pages. Such a graph pickles as its path. :py:meth:`to_igraph`
+    materializes the graph as an :py:class:`igraph.Graph` with a ``name``
+    vertex attribute.
+    """
+
+    FORMAT = 1
+    META = "meta.json"
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, names: StringTable):
+        self.indptr = indptr
+        self.indices = indices
+        self.names = names
+        # directory the arrays are memory-mapped from, if loaded that way
+        self.path: str | None = None
+        self._digest: str | None = None
+
+    def __getstate__(self):
+        # a memory-mapped graph is sent to other processes as its path, and
+        # they map the same files instead of receiving a copy
+        if self.path is not None:
+            return {"path": self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if "indptr" not in state:
+            state = vars(type(self).load(state["path"]))
+        self.__dict__.update(state)
+
+    @classmethod
+    def from_edges(cls, edges: typing.Iterable[mytypes.Edge]) -> "CSRGraph":
+        """Graph of the ``(name, name)`` pairs in ``edges``, consumed as a
+        stream. As with :py:meth:`igraph.Graph.simplify`, duplicate edges and
+        self-loops are dropped."""
+        ids: typing.Dict[str, int] = {}
+        # provisional IDs in order of first appearance
+        ends = array.array("i")
+        for source, target in edges:
+            ends.append(ids.setdefault(source, len(ids)))
+            ends.append(ids.setdefault(target, len(ids)))
+
+        names = sorted(ids)
+        n = len(names)
+        # provisional ID -> position in sorted order
+        rank = np.empty(n, dtype=np.int64)
+        rank[np.fromiter((ids[name] for name in names), np.int64, n)] = np.arange(n)
+        del ids
+
+        ends = rank[np.frombuffer(ends, dtype=np.int32)].reshape(-1, 2)
+        rows = np.concatenate([ends[:, 0], ends[:, 1]])
+        columns = np.concatenate([ends[:, 1], ends[:, 0]])
+        keep = rows != columns
+        pairs = np.unique(rows[keep] * n + columns[keep])
+        rows, columns = np.divmod(pairs, n) if n else (pairs, pairs)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return cls(indptr, columns.astype(np.int32), StringTable.build(names))
+
+    def vcount(self) -> int:
+        return len(self.indptr) - 1
+
+    def ecount(self) -> int:
+        return len(self.indices) // 2
+
+    def neighbors(self, vertex: int) -> np.ndarray:
+        return self.indices[self.indptr[vertex] : self.indptr[vertex + 1]]
+
+    def _arrays(self) -> typing.Dict[str, np.ndarray]:
+        arrays = {"indptr": self.indptr, "indices": self.indices}
+        arrays.update(
+            ("names_" + name, getattr(self.names, name)) for name in StringTable.ARRAYS
+        )
+        return arrays
+
+    def digest(self) -> str:
+        """SHA-1 of the edges and names, stored on :py:meth:`save` so loaded
+        graphs need not hash their arrays again."""
+        if self._digest is None:
+            digest = hashlib.sha1()
+            for values in self._arrays().values():
+                digest.update(np.ascontiguousarray(values).data)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def save(self, path: str):
+        """Write the graph into the directory ``path``.
+
+        The files are written into a temporary sibling directory which then
+        replaces ``path``, so processes that have the previous graph mapped
+        keep reading its (unlinked) files rather than torn or truncated ones.
+        """
+        path = os.path.normpath(path)
+        parent, name = os.path.split(path)
+        os.makedirs(parent or ".", exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".{}.".format(name), dir=parent or ".")
+        try:
+            for array_name, values in self._arrays().items():
+                np.save(os.path.join(staging, array_name + ".npy"), values)
+            # written last, so a directory without it is an interrupted save
+            with open(os.path.join(staging, self.META), "w") as f:
+                json.dump(
+                    {
+                        "format": self.FORMAT,
+                        "vcount": self.vcount(),
+                        "ecount": self.ecount(),
+                        "digest": self.digest(),
+                    },
+                    f,
+                )
+
+            previous = None
+            if os.path.exists(path):
+                # a non-empty directory cannot be replaced directly
+                previous = staging + ".previous"
+                os.replace(path, previous)
+            os.replace(staging, path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if previous is not None:
+            shutil.rmtree(previous)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CSRGraph":
+        try:
+            with open(os.path.join(path, cls.META)) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise GraphFormatError(
+                "{} is not a saved graph, build it with `main.py kg`".format(path)
+            )
+        if meta.get("format") != cls.FORMAT:
+            raise GraphFormatError(
+                "{} has graph format {}, expected {}".format(
+                    path, meta.get("format"), cls.FORMAT
+                )
+            )
+
+        def read(name: str) -> np.ndarray:
+            return np.load(
+                os.path.join(path, name + ".npy"), mmap_mode="r" if mmap else None
+            )
+
+        graph = cls(
+            read("indptr"),
+            read("indices"),
+            StringTable(*(read("names_" + name) for name in StringTable.ARRAYS)),
+        )
+        if mmap:
+            graph.path = path
+        graph._digest = meta.get("digest")
+        logging.getLogger("main").info(
+            "Loaded graph {} with {} vertices and {} edges".format(
+                path, graph.vcount(), graph.ecount()
+            )
+        )
+        return graph
+
+    def to_igraph(self) -> igraph.Graph:
+        """:py:class:`igraph.Graph` view with vertex IDs as in this graph."""
+        rows = np.repeat(np.arange(self.vcount()), np.diff(self.indptr))
+        upper = rows < self.indices
+        graph = igraph.Graph(
+            n=self.vcount(),
+            edges=np.column_stack([rows[upper], self.indices[upper]]).tolist(),
+        )
+        graph.vs["name"] = self.names.names()
+        return graph
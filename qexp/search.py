@@ -1,7 +1,5 @@
 import json
 import logging
-import os.path
-import pathlib
 import typing
 
 import lunr
@@ -9,36 +7,34 @@ from lunr.index import Index
 
 
 class Search(object):
-    def __init__(self, collection: typing.Iterable[pathlib.Path]):
+    def __init__(self, collection: typing.Iterable[typing.Tuple[str, str]]):
         self.index: lunr.index.Index = self._build_index(collection)
 
     def search(self, query):
         return self.index.search(query)
 
     @staticmethod
-    def _build_index(files: typing.Iterable[pathlib.Path]) -> lunr:
+    def _build_index(collection: typing.Iterable[typing.Tuple[str, str]]) -> lunr:
 
-        documents = []
+        # feed lunr lazily, so only the document being tokenized is held in
+        # memory rather than the whole collection
+        n_documents = 0
 
-        for file in files:
-            i = file.stem
-
-            with open(file, "r") as f:
-                data = f.read()
-
-            documents.append(
-                {
+        def documents():
+            nonlocal n_documents
+            for i, data in collection:
+                n_documents += 1
+                yield {
                     "id": i,
                     "body": data,
                 }
-            )
 
-        logging.getLogger("main").info(
-            f"Building search index for {len(documents)} documents..."
-        )
+        logging.getLogger("main").info("Building search index...")
         idx: lunr.index.Index = lunr.lunr(
-            ref="id", fields=("body",), documents=documents
+            ref="id", fields=("body",), documents=documents()
+        )
+        logging.getLogger("main").info(
+            f"Built search index for {n_documents} documents!"
         )
-        logging.getLogger("main").info("Built search index!")
 
         return idx
@@ -4,3 +4,5 @@ from .build_graph import main as build_graph
 from .build_priming import main as build_priming
 from .build_profiles import main as build_profiles
 from .build_search_config import main as build_search_config
+from .compress_cache import main as compress_cache
+from .ingest_dbpedia import main as ingest_dbpedia
@@ -3,10 +3,30 @@ import logging
 import os
 import pickle
 import re
-from collections import defaultdict
-from pathlib import Path
 
-from qexp import Config
+from qexp import DataCache
+
+
+def rebuild_index(extracts: DataCache, index: DataCache) -> int:
+    """Fill ``index`` from the raw revisions in ``extracts``, for revisions
+    cleaned before the category index existed. Returns the number of
+    revisions indexed."""
+    batch = []
+    indexed = 0
+    # scan the raw UTF-8 buffers, decoding only the matched category names
+    for article, contents in extracts.iter_buffers(extracts.keys()):
+        categories = re.findall(rb"\[\[\s*[Cc]ategory\s*:([^\]|]*)", contents)
+        categories = (
+            category.decode("utf-8", errors="replace").strip()
+            for category in categories
+        )
+        batch.append((article, "\n".join(dict.fromkeys(filter(None, categories)))))
+        if len(batch) >= 1000:
+            index.set_many(batch)
+            indexed += len(batch)
+            batch = []
+    index.set_many(batch)
+    return indexed + len(batch)
 
 
 def main(args):
@@ -16,28 +36,23 @@ def main(args):
 
     config = args.config
 
-    extracts_path = Path(config.get("data", "extracts_path"))
-
-    files = extracts_path.glob("*")
-    article_categories = defaultdict(set)
-    for file in files:
-        article = file.stem
-
-        with open(file, "r") as f:
-            contents = f.read()
-
-        categories = re.findall(r"\[\[(Category:.*?)[\]|\|]", contents)
-        categories = [category.replace("Category:", "") for category in categories]
-
-        for cat in categories:
-            article_categories[article].add(cat)
+    # filled by the cleaning step as revisions are stripped
+    index = DataCache.from_config(config, "category_index_path")
+    if args.rebuild:
+        indexed = rebuild_index(DataCache.from_config(config, "extracts_path"), index)
+        logger.info("Indexed the categories of {} revisions".format(indexed))
 
+    rows = 0
     with open(config.get("results", "article_categories"), "w", newline="") as f:
         w = csv.writer(f)
         w.writerow(["article_id", "category"])
-        for aid, cats in article_categories.items():
-            for cat in cats:
+        for aid, cats in index.iter_items(index.keys()):
+            if not cats:
+                continue
+            for cat in cats.split("\n"):
                 w.writerow([aid, cat])
+                rows += 1
+    logger.info("Wrote {} article categories".format(rows))
 
     with open(config.get("data", "profiles_dump"), "rb") as f:
         profiles = pickle.load(f)
@@ -1,4 +1,5 @@
 import argparse
+import itertools as it
 import logging
 import pickle
 from collections import defaultdict
@@ -7,8 +8,7 @@ import gensim
 from gensim.models import Word2Vec
 from nltk.corpus import stopwords
 
-from qexp import DataCache
-from qexp.extractors import WikipediaRevisionExtractor, WikitextExtractor
+from qexp.extractors import revision_extractor, wikitext_extractor
 from qexp.Pipeline import Pipeline
 
 
@@ -26,19 +26,20 @@ def main(args: argparse.Namespace):
     with open(profile_dump, "rb") as f:
         profiles = pickle.load(f)
 
+    # one run over the articles of all profiles, so the step gets a single
+    # report and the worker pools are set up once
+    text_pipeline = Pipeline.from_config(
+        config,
+        revision_extractor(config),
+        wikitext_extractor(config),
+        stream=True,
+    )
+    articles = dict.fromkeys(it.chain.from_iterable(profiles.values()))
+    clean_texts = dict(text_pipeline.run(articles))
+
     texts = defaultdict(list)
     for start, vs in profiles.items():
-        text_pipeline = Pipeline.make_pipeline(
-            WikipediaRevisionExtractor(
-                url=config.get("wikipedia", "endpoint"),
-                cache=DataCache(config.get("data", "extracts_path")),
-            ),
-            WikitextExtractor(
-                cache=DataCache(config.get("data", "clean_path")),
-            ),
-        )
-
-        texts[start].extend(text_pipeline.run(vs))
+        texts[start].extend((v, clean_texts[v]) for v in vs if v in clean_texts)
 
     import nltk
     nltk.download('stopwords')
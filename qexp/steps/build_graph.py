@@ -4,8 +4,6 @@ import logging
 import os
 from pathlib import Path
 
-import igraph as ig
-
 from qexp import Config
 from qexp.builder import KnowledgeGraphBuilder
 
@@ -27,6 +25,7 @@ def main(args: argparse.Namespace):
 
     builder = KnowledgeGraphBuilder(config)
     graph = builder(articles)
-    ig.Graph.write_pickle(graph, config.get("data", "kg_path"))
+    graph.save(config.get("data", "kg_path"))
+    logger.info("Saved {} vertices and {} edges".format(graph.vcount(), graph.ecount()))
 
     return os.EX_OK
@@ -7,7 +7,7 @@ import typing
 from pathlib import Path
 
 from qexp import Config, DataCache
-from qexp.extractors import WikipediaRevisionExtractor, WikitextExtractor
+from qexp.extractors import revision_extractor, wikitext_extractor
 from qexp.extractors.Sampler import Sampler
 from qexp.extractors.WikipediaExtractor import PageLinkExtractor
 from qexp.Pipeline import Pipeline
@@ -45,27 +45,25 @@ def main(args):
 
     config = args.config
 
-    pipeline = Pipeline.make_pipeline(
+    pipeline = Pipeline.from_config(
+        config,
         PageLinkExtractor(
             url="https://en.wikipedia.org/w/api.php",
-            cache=DataCache(config.get("data", "links_path")),
-            exclude_list=list(get_article_ids(config.get("data", "article_path"))),
+            cache=DataCache.from_config(config, "links_path"),
+            exclude_list=get_article_ids(config.get("data", "article_path")),
             no_continue=True,
         ),
         Sampler(
             sample_size=5,
         ),
         Flattener(),
-        WikipediaRevisionExtractor(
-            url=config.get("wikipedia", "endpoint"),
-            cache=DataCache(config.get("data", "extracts_path")),
-        ),
-        WikitextExtractor(
-            cache=DataCache(config.get("data", "clean_path")),
-        ),
+        revision_extractor(config),
+        wikitext_extractor(config),
+        stream=True,
+        retain=(1,),
     )
 
-    _ = pipeline.run(get_parent_titles(config.get("data", "article_path")))
+    Pipeline.drain(pipeline.run(get_parent_titles(config.get("data", "article_path"))))
 
     with open(config.get("data", "links_dump"), "wb") as f:
         pagelinks_dict = {title: links for title, links in pipeline.steps[1][1]}
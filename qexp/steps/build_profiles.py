@@ -4,12 +4,10 @@ import logging
 import os
 import pickle
 
-import igraph as ig
-
-from qexp import DataCache
 from qexp.builder import ProfileBuilder
-from qexp.extractors import WikipediaRevisionExtractor, WikitextExtractor
-from qexp.extractors.SparqlExtractor import WikiPageIdExtractor
+from qexp.extractors import revision_extractor, wikitext_extractor
+from qexp.extractors.DBpediaExtractor import page_id_extractor
+from qexp.graph import CSRGraph
 from qexp.Pipeline import Pipeline
 
 
@@ -27,28 +25,29 @@ def main(args):
 
     config = args.config
 
-    graph = ig.Graph.Read_Pickle(config.get("data", "kg_path"))
+    graph = CSRGraph.load(config.get("data", "kg_path"))
     articles = list(get_article_ids(config.get("data", "article_path")))
 
-    builder = ProfileBuilder()
-    profiles = builder(graph, articles)
-
-    extractor = WikiPageIdExtractor(endpoint=config.get("dbpedia", "sparql_url"))
-
-    profiles = extractor.run(profiles)
-
-    pipeline = Pipeline.make_pipeline(
-        WikipediaRevisionExtractor(
-            url=config.get("wikipedia", "endpoint"),
-            cache=DataCache(config.get("data", "extracts_path")),
-        ),
-        WikitextExtractor(
-            cache=DataCache(config.get("data", "clean_path")),
-        ),
+    with ProfileBuilder(
+        graph, workers=config.get("profiles", "workers") or 4
+    ) as profile_builder:
+        profiles = Pipeline.from_config(
+            config,
+            profile_builder,
+            page_id_extractor(config),
+        ).run(articles)
+
+    pipeline = Pipeline.from_config(
+        config,
+        revision_extractor(config),
+        wikitext_extractor(config),
+        stream=True,
     )
 
     # doing this for the side effect of persisting articles to disk only
-    _ = pipeline.run(it.chain.from_iterable([steps for _, steps in profiles]))
+    Pipeline.drain(
+        pipeline.run(it.chain.from_iterable([steps for _, steps in profiles]))
+    )
 
     profiles = {k: vs for (k, vs) in profiles}
 
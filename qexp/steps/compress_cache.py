@@ -0,0 +1,46 @@
+import argparse
+import itertools as it
+import logging
+import os
+from multiprocessing import Pool
+
+from qexp import DataCache
+
+
+def recompress_chunk(cache_dir: str, backend: str, compression, keys) -> int:
+    cache = DataCache(cache_dir, backend=backend, compression=compression)
+    return cache.recompress(keys)
+
+
+def chunks(keys, size: int):
+    keys = iter(keys)
+    while chunk := list(it.islice(keys, size)):
+        yield chunk
+
+
+def main(args: argparse.Namespace):
+    logger = logging.getLogger("main")
+
+    logger.info("Recompressing caches...")
+
+    config = args.config
+
+    options = args.options or list(config.get("cache", "compression") or {})
+
+    with Pool(args.workers) as p:
+        for option in options:
+            cache = DataCache.from_config(config, option)
+            tasks = zip(
+                it.repeat(cache.cache_dir),
+                it.repeat(cache.backend),
+                it.repeat(cache.compression),
+                chunks(cache.keys(), args.chunk_size),
+            )
+            rewritten = sum(p.starmap(recompress_chunk, tasks))
+            logger.info(
+                "Rewrote {} entries of {} as {}".format(
+                    rewritten, cache.cache_dir, cache.compression or "plain text"
+                )
+            )
+
+    return os.EX_OK
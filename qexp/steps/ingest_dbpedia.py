@@ -0,0 +1,26 @@
+import argparse
+import logging
+import os
+
+from qexp.extractors.DBpediaExtractor import DBpediaStore
+
+
+def main(args: argparse.Namespace):
+    logger = logging.getLogger("main")
+
+    logger.info("Ingesting DBpedia dumps...")
+
+    config = args.config
+
+    store = DBpediaStore(config.get("dbpedia", "store_path"))
+    for table, path in (
+        ("labels", args.labels),
+        ("subjects", args.subjects),
+        ("page_ids", args.page_ids),
+    ):
+        if path is None:
+            continue
+        rows = store.ingest(table, path)
+        logger.info("Stored {} {} from {}".format(rows, table, path))
+
+    return os.EX_OK
@@ -2,3 +2,7 @@ PageID = str
 PageTitle = str
 PipelineResult = tuple[str, str]
 PipelineListResult = tuple[str, list[str]]
+
+# values for a pipeline step's ``parallelism`` attribute
+CPU_BOUND = "cpu"
+IO_BOUND = "io"
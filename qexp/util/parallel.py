@@ -0,0 +1,18 @@
+import math
+import typing
+
+T = typing.TypeVar("T")
+
+# chunks dispatched per worker: a few each, so uneven items even out
+CHUNKS_PER_WORKER = 4
+
+
+def chunk_size(n: int, workers: int) -> int:
+    """Items per chunk when dispatching ``n`` items to ``workers``."""
+    return math.ceil(n / min(n, workers * CHUNKS_PER_WORKER)) if n else 1
+
+
+def chunked(xs: typing.Sequence[T], workers: int) -> typing.List[typing.Sequence[T]]:
+    """``xs`` split into consecutive chunks of :py:func:`chunk_size` items."""
+    size = chunk_size(len(xs), workers)
+    return [xs[start : start + size] for start in range(0, len(xs), size)]